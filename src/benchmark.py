@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+from simple_reference.env import GridEnv as ReferenceEnv, VecGridEnv
+from simple_cover.env import GridEnv as CoverEnv
+from simple_chaser.env import GridEnv as ChaserEnv
+from simple_speaker_listener.env import GridEnv as SpeakerListenerEnv
+
+
+#  name -> make(gridSize, count, batch), where count is the number of
+#  agents, or of landmarks for speaker_listener. make returns None when the
+#  domain has no batched variant
+DOMAINS = {
+    "simple_reference_sparse":
+        lambda G, n, B: ReferenceEnv(G, n, True) if B == 1
+        else VecGridEnv(B, G, n, True),
+    "simple_reference_dense":
+        lambda G, n, B: ReferenceEnv(G, n, False) if B == 1
+        else VecGridEnv(B, G, n, False),
+    "simple_cover": lambda G, n, B: CoverEnv(G, n) if B == 1 else None,
+    "simple_chaser": lambda G, n, B: ChaserEnv(G, n) if B == 1 else None,
+    "simple_speaker_listener":
+        lambda G, n, B: SpeakerListenerEnv(G, n) if B == 1 else None,
+}
+
+
+def bestTime(fn, calls, repeats):
+    """
+    Fastest mean time per call of fn over repeats rounds of calls calls
+    """
+
+    best = float("inf")
+    for r in range(repeats):
+        start = time.perf_counter()
+        for i in range(calls):
+            fn(i)
+        best = min(best, (time.perf_counter() - start) / calls)
+
+    return best
+
+
+def benchmark(domain, gridSize, count, batch, steps, repeats, rng):
+    make = DOMAINS[domain]
+
+    env = make(gridSize, count, batch)
+    if env is None:
+        return None
+
+    actions = rng.integers(0, 5, size=(steps,) + env.agents.shape[:-1])
+    states = np.empty(env.stateShape(), dtype=np.int_)
+    numAgents = 2 if domain == "simple_speaker_listener" else count
+
+    stepTime = bestTime(lambda i: env.act(actions[i]), steps, repeats)
+    allStatesTime = bestTime(lambda i: env.getAllStates(out=states),
+                             steps, repeats)
+    stateTime = bestTime(lambda i: env.getState(i % numAgents),
+                         steps, repeats)
+    resetTime = bestTime(lambda i: env.reset(), max(1, steps // 10),
+                         repeats)
+
+    #  Separate pass, tracemalloc slows down every allocation
+    tracemalloc.start()
+    env = make(gridSize, count, batch)
+    for i in range(min(steps, 10)):
+        env.act(actions[i])
+        env.getAllStates()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"domain": domain,
+            "gridSize": gridSize,
+            "count": count,
+            "batch": batch,
+            "stepsPerSec": 1.0 / stepTime,
+            "worldStepsPerSec": batch / stepTime,
+            "getAllStatesUs": 1e6 * allStatesTime,
+            "getStateUs": 1e6 * stateTime,
+            "resetUs": 1e6 * resetTime,
+            "peakMemoryKB": peak / 1024.0}
+
+
+def key(result):
+    return (result["domain"], result["gridSize"], result["count"],
+            result["batch"])
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the speed of every result relative to baseline and returns the
+    results that slowed down by more than tolerance
+    """
+
+    baseline = {key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = baseline.get(key(result))
+        if old is None:
+            continue
+        ratio = result["worldStepsPerSec"] / old["worldStepsPerSec"]
+        print("%-26s G=%-4d n=%-4d B=%-5d %6.2fx" % (key(result) + (ratio,)))
+        if ratio < 1.0 - tolerance:
+            regressions.append(result)
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Steps per second of every domain")
+    parser.add_argument("--domains", nargs="+", default=sorted(DOMAINS),
+                        choices=sorted(DOMAINS))
+    parser.add_argument("--grid-sizes", nargs="+", type=int,
+                        default=[10, 50])
+    parser.add_argument("--counts", nargs="+", type=int, default=[4, 16],
+                        help="agents, or landmarks for speaker_listener")
+    parser.add_argument("--batch-sizes", nargs="+", type=int,
+                        default=[1, 64])
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed relative slowdown against baseline")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+
+    results = []
+    for domain in args.domains:
+        for gridSize in args.grid_sizes:
+            for count in args.counts:
+                for batch in args.batch_sizes:
+                    result = benchmark(domain, gridSize, count, batch,
+                                       args.steps, args.repeats, rng)
+                    if result is None:
+                        continue
+                    results.append(result)
+                    print("%-26s G=%-4d n=%-4d B=%-5d %12.0f steps/s "
+                          "%8.1f us/getAllStates %8.1f us/reset "
+                          "%8.0f KB" % (key(result) + (
+                              result["worldStepsPerSec"],
+                              result["getAllStatesUs"],
+                              result["resetUs"],
+                              result["peakMemoryKB"])))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
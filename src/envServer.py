@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import os
+import socket
+import struct
+import sys
+import traceback
+import numpy as np
+from gridEnvironment import spawnSeeds
+from registry import checkSingle, envClass as lookupEnvClass, singleDomains
+
+
+#  Every frame is a command byte and a payload length, then the payload.
+#  Payloads are raw little endian arrays whose shapes are fixed by HELLO
+HEADER = struct.Struct("<BI")
+
+HELLO = 0
+STEP = 1
+RESET = 2
+STATES = 3
+CLOSE = 4
+ERROR = 255
+
+
+def makeSocket(address):
+    """
+    Stream socket for address, a (host, port) pair for TCP or a path for a
+    unix socket
+    """
+
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    return sock
+
+
+def sendFrame(sock, command, *arrays):
+    """
+    Sends one frame with a single gathering sendmsg where possible, the
+    arrays are not copied
+    """
+
+    buffers = [memoryview(np.ascontiguousarray(a)).cast("B") for a in arrays]
+    size = sum(len(b) for b in buffers)
+    buffers.insert(0, memoryview(HEADER.pack(command, size)))
+
+    while buffers:
+        sent = sock.sendmsg(buffers)
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers.pop(0)
+        if sent:
+            buffers[0] = buffers[0][sent:]
+
+
+def recvInto(sock, view):
+    while len(view):
+        count = sock.recv_into(view)
+        if count == 0:
+            raise EOFError("Connection closed")
+        view = view[count:]
+
+
+def recvFrame(sock):
+    """
+    Returns the command and payload of the next frame, error frames from
+    the server are raised as RuntimeError
+    """
+
+    header = bytearray(HEADER.size)
+    recvInto(sock, memoryview(header))
+    command, size = HEADER.unpack(header)
+
+    payload = bytearray(size)
+    recvInto(sock, memoryview(payload))
+
+    if command == ERROR:
+        raise RuntimeError("Server failed\n" + payload.decode())
+
+    return command, payload
+
+
+class EnvServer(object):
+    """
+    Hosts numEnvs copies of envClass, a class or a registered domain name,
+    one per seed spawned from seed, and serves reset, step and
+    getAllStates requests to one client at a time. Envs whose episode ends
+    are reset in place, as in SubprocVecEnv
+    """
+
+    def __init__(self, envClass, address, numEnvs=8, seed=None,
+                 **envKwargs):
+        if isinstance(envClass, str):
+            checkSingle(envClass)
+            envClass = lookupEnvClass(envClass)
+
+        self.numEnvs = numEnvs
+        self.envs = [envClass(seed=child, **envKwargs)
+                     for child in spawnSeeds(seed, numEnvs)]
+        if self.envs[0].agents.ndim != 2:
+            raise ValueError("EnvServer hosts single world envs, not " +
+                             envClass.__name__)
+        self.actionShape = self.envs[0].agents.shape[:-1]
+        self.stateShape = self.envs[0].stateShape()
+
+        #  Reply buffers, sent as they are
+        self.actions = np.zeros((numEnvs,) + self.actionShape, dtype=np.int8)
+        self.rewards = np.zeros(numEnvs, dtype=np.float64)
+        self.states = np.zeros((numEnvs,) + self.stateShape, dtype=np.int32)
+        self.dones = np.zeros(numEnvs, dtype=np.bool_)
+        self.truncated = np.zeros(numEnvs, dtype=np.bool_)
+
+        self.path = address if isinstance(address, str) else None
+        self.sock = makeSocket(address)
+        if self.path is None:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(address)
+        self.sock.listen(1)
+
+        #  The bound address, with the real port when port 0 was asked for
+        self.address = self.sock.getsockname()
+
+    def hello(self):
+        return np.array((self.numEnvs, len(self.actionShape)) +
+                        self.actionShape + (len(self.stateShape),) +
+                        self.stateShape, dtype=np.int32)
+
+    def step(self):
+        for i, env in enumerate(self.envs):
+            _, self.rewards[i], self.dones[i], self.truncated[i] = env.step(
+                self.actions[i], out=self.states[i])
+            if self.dones[i] or self.truncated[i]:
+                env.reset(out=self.states[i])
+
+        return self.rewards, self.states, self.dones, self.truncated
+
+    def reset(self):
+        for i, env in enumerate(self.envs):
+            env.reset(out=self.states[i])
+
+        return (self.states,)
+
+    def getAllStates(self):
+        for i, env in enumerate(self.envs):
+            env.getAllStates(out=self.states[i])
+
+        return (self.states,)
+
+    def handle(self, conn):
+        """
+        Answers the requests of one client, in order, until it closes
+        """
+
+        sendFrame(conn, HELLO, self.hello())
+
+        while True:
+            command, payload = recvFrame(conn)
+            if command == CLOSE:
+                sendFrame(conn, CLOSE)
+                return
+
+            try:
+                if command == STEP:
+                    self.actions.reshape(-1)[:] = np.frombuffer(payload,
+                                                                np.int8)
+                    reply = self.step()
+                elif command == RESET:
+                    reply = self.reset()
+                elif command == STATES:
+                    reply = self.getAllStates()
+                else:
+                    raise ValueError("Unknown command " + str(command))
+            except Exception:
+                sendFrame(conn, ERROR,
+                          np.frombuffer(traceback.format_exc().encode(),
+                                        np.uint8))
+            else:
+                sendFrame(conn, command, *reply)
+
+    def serve(self, numClients=None):
+        """
+        Serves clients one after the other, numClients of them or forever
+        """
+
+        served = 0
+        while numClients is None or served < numClients:
+            conn, _ = self.sock.accept()
+            if self.path is None:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                self.handle(conn)
+            except (EOFError, ConnectionError):
+                pass
+            finally:
+                conn.close()
+            served += 1
+
+    def close(self):
+        self.sock.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class EnvClient(object):
+    """
+    Vector env interface to an EnvServer, the same as SubprocVecEnv.
+    step_async only sends, so several steps can be in flight and network
+    latency overlaps with stepping on the server. step_wait reads the
+    replies in the order the steps were sent
+    """
+
+    def __init__(self, address, timeout=None):
+        self.sock = makeSocket(address)
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+        self.pending = collections.deque()
+        self.closed = False
+
+        command, payload = recvFrame(self.sock)
+        if command != HELLO:
+            self.sock.close()
+            raise RuntimeError("Expected HELLO from the server, got command "
+                               + str(command))
+        hello = np.frombuffer(payload, np.int32).tolist()
+        self.numEnvs = hello[0]
+        numDims = hello[1]
+        self.actionShape = tuple(hello[2:2 + numDims])
+        self.stateShape = tuple(hello[3 + numDims:])
+
+    def request(self, command, *arrays):
+        sendFrame(self.sock, command, *arrays)
+        self.pending.append(command)
+
+    def reply(self):
+        command = self.pending.popleft()
+        received, payload = recvFrame(self.sock)
+        if received != command:
+            raise RuntimeError("Reply out of order")
+
+        states = (self.numEnvs,) + self.stateShape
+        if command != STEP:
+            return np.frombuffer(payload, np.int32).reshape(states)
+
+        numStates = int(np.prod(states))
+        rewards = np.frombuffer(payload, np.float64, self.numEnvs)
+        offset = rewards.nbytes
+        stateArray = np.frombuffer(payload, np.int32, numStates, offset)
+        offset += stateArray.nbytes
+        dones = np.frombuffer(payload, np.bool_, self.numEnvs, offset)
+        truncated = np.frombuffer(payload, np.bool_, self.numEnvs,
+                                  offset + self.numEnvs)
+
+        return (stateArray.reshape(states), rewards, dones, truncated)
+
+    def call(self, command):
+        if self.pending:
+            raise RuntimeError("Steps still in flight, call step_wait")
+        self.request(command)
+
+        return self.reply()
+
+    def getAllStates(self):
+        """
+        States of all envs, shape (numEnvs, *stateShape)
+        """
+
+        return self.call(STATES)
+
+    def reset(self):
+        return self.call(RESET)
+
+    def step_async(self, actions):
+        """
+        Sends actions of shape (numEnvs, *actionShape) without waiting, may
+        be called again before step_wait
+        """
+
+        actions = np.asarray(actions)
+        if actions.size != self.numEnvs * int(np.prod(self.actionShape)):
+            raise ValueError("Action size is incorrect")
+
+        self.request(STEP, actions.astype(np.int8))
+
+    def step_wait(self):
+        """
+        Returns states, rewards, dones and truncated flags of the oldest
+        step in flight
+        """
+
+        if not self.pending:
+            raise RuntimeError("step_wait called without step_async")
+
+        return self.reply()
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        try:
+            while self.pending:
+                self.reply()
+            sendFrame(self.sock, CLOSE)
+            recvFrame(self.sock)
+        except (EOFError, OSError, RuntimeError):
+            pass
+        self.sock.close()
+
+
+def parseAddress(text):
+    """
+    host:port for TCP, anything else is a unix socket path
+    """
+
+    host, sep, port = text.rpartition(":")
+    if sep and port.isdigit():
+        return (host, int(port))
+
+    return text
+
+
+def parseValue(text):
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+
+    return {"True": True, "False": False}.get(text, text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a pool of envs")
+    parser.add_argument("domain", choices=singleDomains())
+    parser.add_argument("address", help="host:port or unix socket path")
+    parser.add_argument("--num-envs", type=int, default=8)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--env-arg", nargs="*", default=[],
+                        help="constructor arguments as name=value")
+    args = parser.parse_args(argv)
+
+    envKwargs = dict(arg.split("=", 1) for arg in args.env_arg)
+    envKwargs = {k: parseValue(v) for k, v in envKwargs.items()}
+
+    server = EnvServer(args.domain, parseAddress(args.address), args.num_envs,
+                       args.seed, **envKwargs)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
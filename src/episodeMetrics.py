@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+class RunningStat(object):
+    """
+    Count, mean, variance, min and max of a stream of values, and counts
+    in numBins equal bins over [low, high) when low is given. Values
+    outside the range go to the first or last bin. Memory does not grow
+    with the number of values
+    """
+
+    def __init__(self, low=None, high=None, numBins=None):
+        self.low = low
+        self.high = high
+        self.numBins = numBins
+        if low is not None:
+            self.scale = numBins / float(high - low)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        #  Sum of squared deviations from the mean
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        if self.low is not None:
+            self.histogram = np.zeros(self.numBins, dtype=np.int64)
+
+    def update(self, values):
+        """
+        Adds all values at once, merging their mean and variance into the
+        running ones
+        """
+
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        num = len(values)
+        if num == 0:
+            return
+
+        mean = values.mean()
+        m2 = np.dot(values - mean, values - mean)
+
+        total = self.count + num
+        delta = mean - self.mean
+        self.mean += delta * num / total
+        self.m2 += m2 + delta * delta * self.count * num / total
+        self.count = total
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+        if self.low is not None:
+            bins = ((values - self.low) * self.scale).astype(np.intp)
+            np.clip(bins, 0, self.numBins - 1, out=bins)
+            self.histogram += np.bincount(bins, minlength=self.numBins)
+
+    @property
+    def var(self):
+        return self.m2 / self.count if self.count else np.nan
+
+    def summary(self):
+        summary = {"count": self.count,
+                   "mean": self.mean if self.count else np.nan,
+                   "std": np.sqrt(self.var),
+                   "min": self.min,
+                   "max": self.max}
+        if self.low is not None:
+            summary["histogram"] = self.histogram.copy()
+            summary["edges"] = np.linspace(self.low, self.high,
+                                           self.numBins + 1)
+
+        return summary
+
+
+class EpisodeMetrics(object):
+    """
+    Episode statistics of an env, single world or batched, updated once
+    per step for all worlds together:
+        return          reward summed over each episode
+        length          steps of each episode
+        stepsToReach    step at which each agent first reached its landmark
+        reachedFraction fraction of agents that reached it in each episode
+        collisions      collision counts summed over each episode
+        nearestDistance distance of every target to its nearest agent,
+                        every step
+    stepsToReach and reachedFraction need the agentReached flags of sparse
+    simple_reference, collisions and nearestDistance are added on the first
+    step that sets lastCollisions and lastDistances.
+    histograms maps names to (low, high, numBins) to add or override bins.
+    Per step values are buffered for bufferSteps steps, snapshot includes
+    them
+    """
+
+    def __init__(self, env, histograms=None, trackReached=None,
+                 bufferSteps=256):
+        self.env = env
+        self.bufferSteps = bufferSteps
+        self.numWorlds = int(np.prod(env.agents.shape[:-2]))
+
+        #  Only sparse simple_reference sets agentReached
+        if trackReached is None:
+            trackReached = bool(getattr(env, "sparse", False))
+        self.trackReached = trackReached
+
+        names = ["return", "length"]
+        if trackReached:
+            names += ["stepsToReach", "reachedFraction"]
+
+        bins = {"nearestDistance": (0, env.gridSize + 1, env.gridSize + 1),
+                "reachedFraction": (0, 1.0 + 1e-9, 10)}
+        if env.horizon is not None:
+            bins["length"] = (0, env.horizon + 1, min(env.horizon + 1, 64))
+            bins["stepsToReach"] = bins["length"]
+        bins.update(histograms or {})
+        self.bins = bins
+
+        self.stats = {name: RunningStat(*bins.get(name, ())) for name in names}
+        self.reset()
+
+    def addStat(self, name):
+        stat = RunningStat(*self.bins.get(name, ()))
+        self.stats[name] = stat
+
+        return stat
+
+    def reset(self):
+        """
+        Forgets all statistics and the episodes in progress
+        """
+
+        for stat in self.stats.values():
+            stat.reset()
+
+        self.episodes = 0
+        self.steps = 0
+        self.returns = np.zeros(self.numWorlds)
+        self.lengths = np.zeros(self.numWorlds, dtype=np.int64)
+        self.collisions = np.zeros(self.numWorlds, dtype=np.int64)
+        self.distances = None
+        self.numBuffered = 0
+        if self.trackReached:
+            self.reachStep = np.full((self.numWorlds,) +
+                                     self.env.agentReached.shape[-1:], -1)
+
+    def update(self, reward, done=None, truncated=None):
+        """
+        Adds one step of every world. Call after env.step, with its reward
+        and flags, or after env.act, when the flags come from
+        env.episodeFlags, and before the env is reset
+        """
+
+        env = self.env
+
+        if done is None:
+            done, truncated = env.episodeFlags()
+
+        self.returns += np.reshape(reward, -1)
+        self.lengths += 1
+        self.steps += self.numWorlds
+
+        if env.lastCollisions is not None:
+            if self.distances is None:
+                self.addStat("collisions")
+                self.addStat("nearestDistance")
+                self.distances = np.empty((self.bufferSteps,
+                                           env.lastDistances.size))
+            self.collisions += np.sum(
+                env.lastCollisions.reshape(self.numWorlds, -1), axis=-1)
+
+            #  Per step values are added to their statistic in blocks
+            self.distances[self.numBuffered] = env.lastDistances.reshape(-1)
+            self.numBuffered += 1
+            if self.numBuffered == self.bufferSteps:
+                self.flush()
+
+        if self.trackReached:
+            #  Batched envs reset finished worlds within step and keep the
+            #  flags from before the reset
+            reached = getattr(env, "finalReached", None)
+            if reached is None:
+                reached = env.agentReached
+            reached = reached.reshape(self.numWorlds, -1)
+
+            first = reached & (self.reachStep < 0)
+            if first.any():
+                worlds = np.nonzero(first)[0]
+                self.reachStep[first] = self.lengths[worlds]
+
+        finished = np.nonzero(np.reshape(np.logical_or(done, truncated),
+                                         -1))[0]
+        if len(finished):
+            self.endEpisodes(finished)
+
+    def flush(self):
+        if self.numBuffered:
+            self.stats["nearestDistance"].update(
+                self.distances[:self.numBuffered])
+            self.numBuffered = 0
+
+    def endEpisodes(self, worlds):
+        stats = self.stats
+
+        stats["return"].update(self.returns[worlds])
+        stats["length"].update(self.lengths[worlds])
+        if "collisions" in stats:
+            stats["collisions"].update(self.collisions[worlds])
+
+        if self.trackReached:
+            reachStep = self.reachStep[worlds]
+            stats["stepsToReach"].update(reachStep[reachStep >= 0])
+            stats["reachedFraction"].update(np.mean(reachStep >= 0,
+                                                    axis=-1))
+            self.reachStep[worlds] = -1
+
+        self.returns[worlds] = 0.0
+        self.lengths[worlds] = 0
+        self.collisions[worlds] = 0
+        self.episodes += len(worlds)
+
+    def snapshot(self):
+        """
+        Summary of every statistic so far, its size depends only on the
+        number of bins
+        """
+
+        self.flush()
+        snapshot = {name: stat.summary() for name, stat in self.stats.items()}
+        snapshot["episodes"] = self.episodes
+        snapshot["steps"] = self.steps
+
+        return snapshot
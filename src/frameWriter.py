@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import os
+import queue
+import threading
+import numpy as np
+from gridRenderer import writePng
+
+
+class FrameWriter(object):
+    """
+    Encodes and writes rendered frames on a background thread. Attach it to
+    an env with env.frameWriter = FrameWriter(directory) and act(viz=True)
+    only pays for a render and a copy.
+
+    fileFormat "png" writes one file per frame, "gif" collects the frames
+    of an episode into one animation written on endEpisode (needs Pillow).
+    policy "block" waits for room when the queue is full, "drop" discards
+    the frame and counts it in self.dropped
+    """
+
+    END_EPISODE = "end episode"
+    CLOSE = "close"
+
+    def __init__(self, directory, maxQueue=64, policy="block",
+                 fileFormat="png", frameDuration=100):
+        if policy not in ("block", "drop"):
+            raise ValueError("policy must be block or drop")
+        if fileFormat not in ("png", "gif"):
+            raise ValueError("fileFormat must be png or gif")
+
+        self.directory = directory
+        self.policy = policy
+        self.fileFormat = fileFormat
+        self.frameDuration = frameDuration
+        self.dropped = 0
+        self.episode = 0
+        self.error = None
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.queue = queue.Queue(maxsize=maxQueue)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, frame, name):
+        """
+        Queues a copy of frame to be written as name
+        """
+
+        self.checkError()
+        item = (np.array(frame, dtype=np.uint8), str(name))
+
+        if self.policy == "block":
+            self.queue.put(item)
+        else:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+
+    def endEpisode(self):
+        """
+        Closes the current episode, writing its animation in gif format
+        """
+
+        self.checkError()
+        self.queue.put(self.END_EPISODE)
+
+    def close(self):
+        """
+        Writes all queued frames and stops the thread
+        """
+
+        if self.thread.is_alive():
+            if self.fileFormat == "gif":
+                self.queue.put(self.END_EPISODE)
+            self.queue.put(self.CLOSE)
+            self.thread.join()
+        self.checkError()
+
+    def checkError(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Frame writer failed") from error
+
+    def run(self):
+        episodeFrames = []
+        while True:
+            item = self.queue.get()
+            if item == self.CLOSE:
+                break
+
+            try:
+                if item == self.END_EPISODE:
+                    if episodeFrames:
+                        self.writeGif(episodeFrames)
+                    episodeFrames = []
+                    self.episode += 1
+                elif self.fileFormat == "gif":
+                    episodeFrames.append(item[0])
+                else:
+                    frame, name = item
+                    writePng(os.path.join(self.directory, name + ".png"),
+                             frame)
+            except Exception as error:
+                self.error = error
+
+    def writeGif(self, frames):
+        from PIL import Image
+
+        images = [Image.fromarray(frame) for frame in frames]
+        path = os.path.join(self.directory,
+                            "episode_" + str(self.episode) + ".gif")
+        images[0].save(path, save_all=True, append_images=images[1:],
+                       duration=self.frameDuration, loop=0)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import sys
+import time
+import numpy as np
+
+from envServer import parseValue
+from registry import DOMAINS, make
+
+
+#  Compared after every step, in this order
+FIELDS = ("reward", "done", "truncated", "states", "snapshot")
+
+
+def traceSeed(seed, world=None):
+    """
+    SeedSequence of the recorded env. With world, the seed of that world
+    of a batched or multiprocess env built with seed
+    """
+
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    if world is not None:
+        seed = seed.spawn(world + 1)[world]
+
+    return seed
+
+
+class GoldenTrace(object):
+    """
+    A seeded reference trajectory of one env: the actions taken, then
+    rewards, done and truncated flags per step, and getAllStates and
+    get_snapshot before the first step and after every step. Envs are
+    reset as soon as an episode ends, so the states and snapshot of that
+    step are those of the next episode, as vector envs return them
+    """
+
+    def __init__(self, domain, envKwargs, entropy, spawnKey, rngState,
+                 actions, rewards, dones, truncated, states, snapshots):
+        self.domain = domain
+        self.envKwargs = envKwargs
+        self.entropy = entropy
+        self.spawnKey = tuple(spawnKey)
+        self.rngState = rngState
+        self.actions = actions
+        self.rewards = rewards
+        self.dones = dones
+        self.truncated = truncated
+        self.states = states
+        self.snapshots = snapshots
+
+    @property
+    def numSteps(self):
+        return len(self.actions)
+
+    def seed(self):
+        return np.random.SeedSequence(self.entropy, spawn_key=self.spawnKey)
+
+    def makeEnv(self, seed=None):
+        """
+        New env of the trace, built as the recorded one was
+        """
+
+        if seed is None:
+            seed = self.seed()
+
+        return make(self.domain, seed=seed, **self.envKwargs)
+
+    def save(self, path):
+        meta = {"domain": self.domain, "envKwargs": self.envKwargs,
+                "entropy": str(self.entropy),
+                "spawnKey": list(self.spawnKey), "rngState": self.rngState}
+        np.savez_compressed(path, meta=json.dumps(meta), actions=self.actions,
+                            rewards=self.rewards, dones=self.dones,
+                            truncated=self.truncated, states=self.states,
+                            snapshots=self.snapshots)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            return cls(meta["domain"], meta["envKwargs"],
+                       int(meta["entropy"]), meta["spawnKey"],
+                       meta["rngState"], data["actions"], data["rewards"],
+                       data["dones"], data["truncated"], data["states"],
+                       data["snapshots"])
+
+
+def recordTrace(domain, numSteps=200, seed=0, actionSeed=0, policy=None,
+                **envKwargs):
+    """
+    Steps a fresh env of domain for numSteps steps and returns the trace.
+    Actions are uniform from actionSeed unless policy, a function of the
+    env, gives them. The trace holds the semantics of the env classes as
+    they stand, e.g. simple_cover and simple_chaser divide the running
+    reward by gridSize inside the target loop, and simple_chaser
+    observations hold prey only for agents with an index below numPrey
+    """
+
+    seed = traceSeed(seed)
+    env = make(domain, seed=seed, **envKwargs)
+    if env.agents.ndim != 2:
+        raise ValueError("Traces are recorded from single world envs")
+    rngState = env.rng.bit_generator.state
+    actionRng = np.random.default_rng(actionSeed)
+    actionShape = env.agents.shape[:-1]
+
+    actions = np.zeros((numSteps,) + actionShape, dtype=np.int8)
+    rewards = np.zeros(numSteps)
+    dones = np.zeros(numSteps, dtype=bool)
+    truncated = np.zeros(numSteps, dtype=bool)
+    states = [env.getAllStates().copy()]
+    snapshots = [env.get_snapshot()]
+
+    for t in range(numSteps):
+        if policy is None:
+            actions[t] = actionRng.integers(0, 5, size=actionShape)
+        else:
+            actions[t] = np.reshape(policy(env), actionShape)
+
+        state, rewards[t], dones[t], truncated[t] = env.step(actions[t])
+        if dones[t] or truncated[t]:
+            state = env.reset()
+
+        states.append(state.copy())
+        snapshots.append(env.get_snapshot())
+
+    return GoldenTrace(domain, envKwargs, seed.entropy, seed.spawn_key,
+                       rngState, actions, rewards, dones, truncated,
+                       np.stack(states), np.stack(snapshots))
+
+
+class WorldView(object):
+    """
+    One world of a vector env (VecGridEnv, SubprocVecEnv, EnvClient) seen
+    as a single env. Every world gets the same actions, and envs that end
+    an episode are reset, as by the vector envs themselves
+    """
+
+    def __init__(self, vecEnv, world=0):
+        self.vecEnv = vecEnv
+        self.world = world
+        if hasattr(vecEnv, "get_snapshot"):
+            self.get_snapshot = lambda: vecEnv.get_snapshot()[world]
+
+    def getAllStates(self):
+        return self.vecEnv.getAllStates()[self.world]
+
+    def step(self, actions):
+        actions = np.broadcast_to(actions,
+                                  (self.vecEnv.numEnvs,) + np.shape(actions))
+        states, rewards, dones, truncated = self.vecEnv.step(actions)
+
+        return (states[self.world], rewards[self.world], dones[self.world],
+                truncated[self.world])
+
+    def close(self):
+        if hasattr(self.vecEnv, "close"):
+            self.vecEnv.close()
+
+
+class SingleEnv(object):
+    """
+    A single GridEnv as the harness drives it, reset after every episode
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.get_snapshot = env.get_snapshot
+
+    def getAllStates(self):
+        return self.env.getAllStates()
+
+    def step(self, actions):
+        states, reward, done, truncated = self.env.step(actions)
+        if done or truncated:
+            states = self.env.reset()
+
+        return states, reward, done, truncated
+
+    def close(self):
+        pass
+
+
+def restoredEnv(trace):
+    """
+    Env built with another seed and brought to the start of the trace by
+    set_snapshot, with the Generator state copied over
+    """
+
+    env = trace.makeEnv(seed=np.random.SeedSequence())
+    env.set_snapshot(trace.snapshots[0])
+    env.rng.bit_generator.state = trace.rngState
+
+    return SingleEnv(env)
+
+
+class Divergence(object):
+    """
+    First difference between a replay and its trace
+    """
+
+    def __init__(self, step, field, expected, actual):
+        self.step = step
+        self.field = field
+        self.expected = np.asarray(expected)
+        self.actual = np.asarray(actual)
+
+    def __str__(self):
+        where = ""
+        if self.expected.shape != self.actual.shape:
+            where = " shape %s != %s" % (self.expected.shape,
+                                         self.actual.shape)
+        elif self.expected.ndim:
+            index = np.argwhere(self.expected != self.actual)[0]
+            where = " at %s: %r != %r" % (
+                tuple(index.tolist()), self.expected[tuple(index)].item(),
+                self.actual[tuple(index)].item())
+        else:
+            where = ": %r != %r" % (self.expected.item(), self.actual.item())
+
+        return "step %d, %s%s" % (self.step, self.field, where)
+
+
+def firstDifference(step, values, trace, index):
+    """
+    Divergence of values, a dict of fields, from the trace after index
+    steps, or None. Rewards must match bit for bit
+    """
+
+    expected = {"states": trace.states[index],
+                "snapshot": trace.snapshots[index]}
+    if index > 0:
+        expected["reward"] = trace.rewards[index - 1]
+        expected["done"] = trace.dones[index - 1]
+        expected["truncated"] = trace.truncated[index - 1]
+
+    for field in FIELDS:
+        if field not in values or field not in expected:
+            continue
+        actual = np.asarray(values[field])
+        if actual.shape != expected[field].shape or \
+                not np.array_equal(actual, expected[field]):
+            return Divergence(step, field, expected[field], actual)
+
+    return None
+
+
+def replay(trace, candidate):
+    """
+    Drives candidate, with getAllStates, step and optionally get_snapshot,
+    through the actions of trace. Returns the first Divergence or None,
+    and the seconds spent in step
+    """
+
+    hasSnapshot = hasattr(candidate, "get_snapshot")
+
+    values = {"states": candidate.getAllStates()}
+    if hasSnapshot:
+        values["snapshot"] = candidate.get_snapshot()
+    divergence = firstDifference(0, values, trace, 0)
+    if divergence is not None:
+        return divergence, 0.0
+
+    seconds = 0.0
+    for t in range(trace.numSteps):
+        start = time.perf_counter()
+        states, reward, done, truncated = candidate.step(trace.actions[t])
+        seconds += time.perf_counter() - start
+
+        values = {"reward": reward, "done": done, "truncated": truncated,
+                  "states": states}
+        if hasSnapshot:
+            values["snapshot"] = candidate.get_snapshot()
+        divergence = firstDifference(t + 1, values, trace, t + 1)
+        if divergence is not None:
+            return divergence, seconds
+
+    return None, seconds
+
+
+def standardCandidates(trace, numEnvs=4):
+    """
+    name -> make() of the implementations the trace can be replayed on.
+    Batched and multiprocess envs are included when the trace seed is a
+    world seed from traceSeed(seed, world)
+    """
+
+    candidates = {"reference": lambda: SingleEnv(trace.makeEnv()),
+                  "snapshot": lambda: restoredEnv(trace)}
+
+    if not trace.spawnKey:
+        return candidates
+
+    world = trace.spawnKey[-1]
+    numEnvs = max(numEnvs, world + 1)
+
+    def parentSeed():
+        return np.random.SeedSequence(trace.entropy,
+                                      spawn_key=trace.spawnKey[:-1])
+
+    if trace.domain == "simple_reference":
+        candidates["batched"] = lambda: WorldView(
+            make("simple_reference_vec", numEnvs=numEnvs, seed=parentSeed(),
+                 **trace.envKwargs), world)
+
+    def subproc():
+        from subprocEnvironment import SubprocVecEnv
+        return WorldView(SubprocVecEnv(trace.domain, numEnvs, numWorkers=2,
+                                       seed=parentSeed(), **trace.envKwargs),
+                         world)
+
+    candidates["multiprocess"] = subproc
+
+    return candidates
+
+
+def compare(trace, candidates):
+    """
+    Replays trace on every candidate, a dict of name -> make(). Returns
+    rows of name, Divergence or None, seconds and speedup over the first
+    candidate
+    """
+
+    rows = []
+    for name, makeCandidate in candidates.items():
+        candidate = makeCandidate()
+        try:
+            divergence, seconds = replay(trace, candidate)
+        finally:
+            candidate.close()
+        rows.append([name, divergence, seconds])
+
+    baseline = rows[0][2] if rows else 0.0
+    for row in rows:
+        row.append(baseline / row[2] if row[2] > 0 else float("nan"))
+
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record golden traces or "
+                                     "check implementations against them")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record")
+    record.add_argument("domain", choices=sorted(DOMAINS))
+    record.add_argument("path")
+    record.add_argument("--steps", type=int, default=200)
+    record.add_argument("--seed", type=int, default=0)
+    record.add_argument("--world", type=int,
+                        help="record this world of a vector env with seed")
+    record.add_argument("--action-seed", type=int, default=0)
+    record.add_argument("--env-arg", nargs="*", default=[],
+                        help="constructor arguments as name=value")
+
+    check = commands.add_parser("check")
+    check.add_argument("paths", nargs="+")
+    check.add_argument("--num-envs", type=int, default=4)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        envKwargs = dict(arg.split("=", 1) for arg in args.env_arg)
+        envKwargs = {k: parseValue(v) for k, v in envKwargs.items()}
+        trace = recordTrace(args.domain, args.steps,
+                            traceSeed(args.seed, args.world),
+                            args.action_seed, **envKwargs)
+        trace.save(args.path)
+        return 0
+
+    failed = False
+    for path in args.paths:
+        trace = GoldenTrace.load(path)
+        rows = compare(trace, standardCandidates(trace, args.num_envs))
+        for name, divergence, seconds, speedup in rows:
+            status = "ok" if divergence is None else "FAIL " + str(divergence)
+            failed |= divergence is not None
+            print("%s %-13s %8.2f steps/ms %6.2fx  %s" % (
+                path, name, trace.numSteps / max(seconds, 1e-9) / 1e3,
+                speedup, status))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
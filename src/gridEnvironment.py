@@ -1,8 +1,292 @@
 #!/usr/bin/env python3
 
+import os
+import numpy as np
+from gridRenderer import GridRenderer, writePng
+
+
+def torusDistance(a, b, gridSize):
+    """
+    Manhattan distance on the torus between positions a and b, broadcast
+    over all leading dimensions. Use a[..., :, None, :] and
+    b[..., None, :, :] for the full distance matrix
+    """
+
+    dist = np.absolute(a - b)
+    np.minimum(dist, gridSize - dist, out=dist)
+
+    return np.sum(dist, axis=-1)
+
+
+def spawnSeeds(seed, num):
+    """
+    num independent, reproducible child seeds of seed, one per env or per
+    world. seed is an int, None or a SeedSequence
+    """
+
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    return seed.spawn(num)
+
+
+def cellIndex(positions, gridSize):
+    """
+    Linearized cell index row * gridSize + column of every position
+    """
+
+    return positions[..., 0].astype(np.intp) * gridSize + positions[..., 1]
+
+
+def occupancy(positions, gridSize):
+    """
+    Number of positions in every cell, shape (..., gridSize, gridSize).
+    Leading batch dimensions are counted separately
+    """
+
+    cells = cellIndex(positions, gridSize)
+    batchShape = cells.shape[:-1]
+    numCells = gridSize * gridSize
+    numWorlds = int(np.prod(batchShape))
+
+    #  Offset every world into its own block of cells, one bincount in total
+    offsets = np.arange(numWorlds).reshape(batchShape + (1,)) * numCells
+    counts = np.bincount((cells + offsets).reshape(-1),
+                         minlength=numWorlds * numCells)
+
+    return counts.reshape(batchShape + (gridSize, gridSize))
+
+
+def collisionCounts(positions, gridSize):
+    """
+    Number of other positions sharing the cell of each position. A single
+    world is counted with an occupancy grid, in time linear in positions
+    and cells. Batches are counted by sorting the cells of every world,
+    so memory does not grow with gridSize ** 2 per world
+    """
+
+    if positions.ndim > 2:
+        return sortedCollisionCounts(cellIndex(positions, gridSize))
+
+    counts = occupancy(positions, gridSize)
+    counts = counts.reshape(counts.shape[:-2] + (-1,))
+
+    return np.take_along_axis(counts, cellIndex(positions, gridSize),
+                              axis=-1) - 1
+
+
+def nearestDistances(targets, agents, gridSize):
+    """
+    Torus distance from every target to its nearest agent, batched over
+    leading dimensions
+    """
+
+    distances = torusDistance(targets[..., :, None, :],
+                              agents[..., None, :, :], gridSize)
+
+    return np.min(distances, axis=-1)
+
+
+def sortedCollisionCounts(cells):
+    """
+    collisionCounts from the cell indices of shape (..., n), in
+    O(n log n) per world
+    """
+
+    order = np.argsort(cells, axis=-1, kind="stable")
+    ranked = np.take_along_axis(cells, order, axis=-1)
+
+    #  Every position spans the run of equal cells it sorts into
+    n = cells.shape[-1]
+    index = np.broadcast_to(np.arange(n), cells.shape)
+    starts = np.ones(cells.shape, dtype=bool)
+    starts[..., 1:] = ranked[..., 1:] != ranked[..., :-1]
+    ends = np.ones(cells.shape, dtype=bool)
+    ends[..., :-1] = starts[..., 1:]
+
+    first = np.maximum.accumulate(np.where(starts, index, 0), axis=-1)
+    last = np.flip(np.minimum.accumulate(
+        np.flip(np.where(ends, index, n), axis=-1), axis=-1), axis=-1)
+
+    counts = np.empty(cells.shape, dtype=np.intp)
+    np.put_along_axis(counts, order, last - first, axis=-1)
+
+    return counts
+
+
+def torusRings(gridSize):
+    """
+    Every cell offset (row, column) in [0, gridSize) ** 2 ordered by torus
+    distance, and the start of each distance in that order
+    """
+
+    steps = np.arange(gridSize)
+    steps = np.minimum(steps, gridSize - steps)
+    distances = (steps[:, None] + steps[None, :]).reshape(-1)
+
+    order = np.argsort(distances, kind="stable")
+    offsets = np.stack([order // gridSize, order % gridSize], axis=-1)
+    starts = np.searchsorted(distances[order],
+                             np.arange(distances.max() + 2))
+
+    return offsets, starts
+
+
+def coverageReward(nearest, collisions, gridSize):
+    """
+    Reward of simple_cover and simple_chaser, batched over leading
+    dimensions, from the nearestDistances of the targets. For every target
+    in turn its distance and gridSize per collision of the agent with the
+    same index are subtracted, then the running reward is divided by
+    gridSize
+    """
+
+    numTargets = nearest.shape[-1]
+
+    if nearest.ndim == 1:
+        #  Single world, Python scalars are cheaper than 0-d arrays
+        reward = 0.0
+        for dist, count in zip(nearest.tolist(),
+                               collisions[:numTargets].tolist()):
+            reward = reward - dist
+            for k in range(count):
+                reward -= gridSize
+            reward = reward / gridSize
+
+        return np.float64(reward)
+
+    batchAxes = tuple(range(collisions.ndim - 1))
+    maxPenalties = collisions[..., :numTargets].max(axis=batchAxes,
+                                                    initial=0).tolist()
+
+    reward = np.zeros(nearest.shape[:-1])
+    for i in range(numTargets):
+        reward = reward - nearest[..., i]
+
+        #  One gridSize at a time, so rounding matches the scalar loop
+        for k in range(maxPenalties[i]):
+            reward = np.where(collisions[..., i] > k, reward - gridSize,
+                              reward)
+
+        reward = reward / gridSize
+
+    return reward
+
+
+def greedyActions(agents, goals, gridSize):
+    """
+    Action of every agent one step along the shorter way round the torus
+    towards its goal, on the axis with the longer way to go (rows on
+    ties), NOOP at the goal. Actions are numbered as in defineMoves
+    """
+
+    offset = goals.astype(np.int64) - agents
+    offset = (offset + gridSize // 2) % gridSize - gridSize // 2
+    rows = offset[..., 0]
+    cols = offset[..., 1]
+
+    #  NOOP, then LEFT or RIGHT, then UP or DOWN where they apply
+    actions = np.zeros(rows.shape, dtype=np.int8)
+    actions[cols < 0] = 1
+    actions[cols > 0] = 2
+    onRows = np.absolute(rows) >= np.absolute(cols)
+    actions[onRows & (rows < 0)] = 3
+    actions[onRows & (rows > 0)] = 4
+
+    return actions
+
+
+def greedyAssignment(distances):
+    """
+    Target of every agent from (..., numAgents, numTargets) distances,
+    pairing the closest free agents and targets first. Each round pairs
+    every free agent and target that are each other's nearest, at least
+    one pair per world, so there are at most min(numAgents, numTargets)
+    rounds. Agents left over when targets run out take their nearest
+    target
+    """
+
+    distances = np.asarray(distances, dtype=np.float64)
+    numAgents, numTargets = distances.shape[-2:]
+    batchShape = distances.shape[:-2]
+
+    assigned = np.full(batchShape + (numAgents,), -1, dtype=np.intp)
+    if numTargets == 0:
+        return assigned
+
+    freeAgents = np.ones(batchShape + (numAgents,), dtype=bool)
+    freeTargets = np.ones(batchShape + (numTargets,), dtype=bool)
+    agentIds = np.arange(numAgents)
+    targetIds = np.arange(numTargets)
+
+    for r in range(min(numAgents, numTargets)):
+        masked = np.where(freeAgents[..., :, None] & freeTargets[..., None, :],
+                          distances, np.inf)
+        nearestTarget = np.argmin(masked, axis=-1)
+        nearestAgent = np.argmin(masked, axis=-2)
+
+        #  Free pairs where the agent's nearest target has it as nearest
+        #  agent. Worlds out of free agents or targets pair no more
+        mutual = freeAgents & \
+            np.take_along_axis(freeTargets, nearestTarget, axis=-1) & \
+            (np.take_along_axis(nearestAgent, nearestTarget, axis=-1) ==
+             agentIds)
+        if not mutual.any():
+            break
+
+        paired = freeTargets & \
+            np.take_along_axis(freeAgents, nearestAgent, axis=-1) & \
+            (np.take_along_axis(nearestTarget, nearestAgent, axis=-1) ==
+             targetIds)
+
+        assigned[mutual] = nearestTarget[mutual]
+        freeAgents &= ~mutual
+        freeTargets &= ~paired
+
+    leftOver = assigned < 0
+    if leftOver.any():
+        assigned[leftOver] = np.argmin(distances, axis=-1)[leftOver]
+
+    return assigned
+
 
 class MultiAgentGrid(object):
 
+    #  Created on the first render
+    gridRenderer = None
+    #  When set, visualizeState hands frames to this background writer
+    frameWriter = None
+    #  When set, act and getState time their phases into this PhaseStats
+    profiler = None
+    #  Episodes are truncated after this many steps, never when None
+    horizon = None
+    #  entities[stateIndex] - agents, kept between calls and refreshed from
+    #  the entities flagged in movedEntities on the next read
+    relCache = None
+    movedEntities = None
+    stateColumns = None
+    #  Relative cost of one cell of the outward search of getNearestStates
+    #  against one entry of its dense search
+    gridNearestCost = 4
+    torusRings = None
+    #  Caches with fewer entries are refreshed whole rather than in place
+    fullRefreshSize = 32768
+    #  When set, reset and the auto-resets of batched envs restore start
+    #  states served by this ResetBank instead of drawing them
+    resetBank = None
+    #  Collision counts and nearest agent distances of the last act, set
+    #  by the domains that compute them
+    lastCollisions = None
+    lastDistances = None
+
+    #  Channels of getLocalStates and entity types of getNearestStates:
+    #  agents, then every other entity
+    channelNames = ("agents", "landmarks")
+
+    #  World state packed by get_snapshot, in order
+    snapshotScalars = ("steps",)
+    snapshotArrays = ("entities", "agentReached")
+
     def __init__(self, gridSize=7):
         self.gridSize = gridSize
         self.defineMoves()
@@ -14,5 +298,725 @@ class MultiAgentGrid(object):
         self.UP = 3
         self.DOWN = 4
 
+        #  Positions are kept in one compact array per entity type
+        if self.gridSize < np.iinfo(np.int16).max:
+            self.positionDtype = np.int16
+        else:
+            self.positionDtype = np.int64
+
+        #  Row a is the displacement caused by action a
+        self.moveDeltas = np.array([[0, 0],
+                                    [0, -1],
+                                    [0, 1],
+                                    [-1, 0],
+                                    [1, 0]], dtype=self.positionDtype)
+        self.moveBuffer = None
+
     def reset_world(self):
         raise NotImplementedError
+
+    def resetArgs(self):
+        """
+        Arguments of reset_world that start a new episode of the same world
+        """
+
+        return ()
+
+    def reset(self, out=None):
+        """
+        Starts a new episode and returns getAllStates()
+        """
+
+        if self.resetBank is None:
+            self.reset_world(*self.resetArgs())
+        else:
+            self.resetBank.restore(self)
+
+        return self.getAllStates(out=out)
+
+    def isDone(self):
+        """
+        Whether the task of every world is solved, never by default
+        """
+
+        return np.zeros(self.agents.shape[:-2], dtype=bool)[()]
+
+    def episodeFlags(self):
+        """
+        (done, truncated) of every world. done when the task is solved,
+        truncated when horizon steps passed without solving it
+        """
+
+        done = self.isDone()
+        if self.horizon is None:
+            truncated = np.zeros_like(done)
+        else:
+            truncated = (np.asarray(self.steps) >= self.horizon) & ~done
+
+        return done, truncated
+
+    def step(self, actions, out=None):
+        """
+        Returns (states, reward, done, truncated) after acting with
+        actions. Call reset once the episode is done or truncated
+        """
+
+        reward = self.act(actions)
+        done, truncated = self.episodeFlags()
+
+        return self.getAllStates(out=out), reward, done, truncated
+
+    def sequenceRewards(self, trajectory, numPlans):
+        """
+        Rewards of every step of agent trajectories of shape
+        (..., T, numAgents, 2), and the resulting world state as a dict of
+        snapshotArrays values. numPlans > 0 when the leading dimension
+        holds independent plans from the current state
+        """
+        raise NotImplementedError
+
+    def finalEntities(self, trajectory):
+        """
+        Copy of self.entities for every sequence of trajectory, with the
+        agents at their last position
+        """
+
+        leadShape = trajectory.shape[:-3]
+        entities = np.broadcast_to(
+            self.entities, leadShape + self.entities.shape[-2:]).copy()
+        entities[..., :trajectory.shape[-2], :] = trajectory[..., -1, :, :]
+
+        return entities
+
+    def act_sequence(self, actions):
+        """
+        Runs a T step action plan in one vectorized pass. actions has shape
+        (*batch, T, numAgents) for an env whose act takes (*batch,
+        numAgents), the env then advances as after T calls of act. A
+        single world env also takes (P, T, numAgents): P plans evaluated
+        from the current state, which is left untouched.
+        Returns rewards of shape (..., T) and the final state of every
+        sequence as get_snapshot rows
+        """
+
+        actions = np.asarray(actions)
+        actionShape = self.agents.shape[:-1]
+
+        batchShape = actionShape[:-1]
+        numBatch = len(batchShape)
+        if actions.ndim < numBatch + 2 or \
+                actions.shape[-1] != actionShape[-1] or \
+                actions.shape[actions.ndim - numBatch - 2:-2] != batchShape:
+            raise ValueError("Action size is incorrect")
+
+        numPlans = 0
+        if actions.ndim == numBatch + 3 and numBatch == 0:
+            numPlans = actions.shape[0]
+        elif actions.ndim != numBatch + 2:
+            raise ValueError("Action size is incorrect")
+
+        if actions.size and (actions.min() < self.NOOP or
+                             actions.max() > self.DOWN):
+            raise ValueError("Invalid action")
+
+        numSteps = actions.shape[-2]
+        if numSteps == 0:
+            snapshot = self.get_snapshot()
+            if numPlans:
+                snapshot = np.repeat(snapshot[None], numPlans, axis=0)
+            return np.zeros(actions.shape[:-1]), snapshot
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+
+        #  Position after every step, wide integers so the sum cannot wrap
+        moves = np.cumsum(self.moveDeltas[actions], axis=-3, dtype=np.int64)
+        trajectory = np.expand_dims(self.agents, -3) + moves
+        np.remainder(trajectory, self.gridSize, out=trajectory)
+
+        if profiler is not None:
+            start = profiler.lap("sequenceMove", start)
+
+        rewards, final = self.sequenceRewards(trajectory, numPlans)
+
+        if profiler is not None:
+            profiler.lap("sequenceReward", start)
+
+        if numPlans:
+            values = {name: getattr(self, name)
+                      for name in self.snapshotScalars}
+            values["steps"] = self.steps + numSteps
+            values.update(final)
+
+            parts = [np.broadcast_to(values[name], (numPlans, 1))
+                     for name in self.snapshotScalars]
+            parts += [np.broadcast_to(
+                values.get(name, getattr(self, name)),
+                (numPlans,) + getattr(self, name).shape).reshape(
+                    numPlans, -1)
+                for name in self.snapshotArrays]
+
+            return rewards, np.concatenate(parts, axis=1, dtype=np.int32)
+
+        #  Entities that ended elsewhere are refreshed in the state cache
+        if self.movedEntities is not None:
+            self.movedEntities |= np.any(final["entities"] != self.entities,
+                                         axis=-1)
+
+        for name, value in final.items():
+            getattr(self, name)[...] = value
+        self.steps += numSteps
+
+        return rewards, self.get_snapshot()
+
+    def stateLayout(self):
+        """
+        Entity order seen by every agent, as indices into self.entities,
+        and the agent whose own row drops each entry (-1 for none)
+        """
+        raise NotImplementedError
+
+    def buildStateIndex(self):
+        """
+        Row k lists the self.entities rows in getState(k), in order
+        """
+
+        sequence, owner = self.stateLayout()
+        keep = owner[None, :] != np.arange(self.numAgents)[:, None]
+        sequence = np.broadcast_to(sequence, keep.shape)
+
+        return sequence[keep].reshape(self.numAgents, -1)
+
+    def columnIndex(self):
+        """
+        Column of entity e in row k of stateIndex at [e, k], -1 when
+        unseen. Built once, stateIndex does not change
+        """
+
+        if self.stateColumns is None:
+            numObs = self.stateIndex.shape[1]
+            self.stateColumns = np.full(
+                (self.entities.shape[-2], self.numAgents), -1)
+            self.stateColumns[self.stateIndex,
+                              np.arange(self.numAgents)[:, None]] = \
+                np.arange(numObs)
+
+        return self.stateColumns
+
+    def invalidateCache(self):
+        """
+        Drops the cached relative positions. Needed after positions are
+        written directly instead of through act or reset_world
+        """
+
+        self.relCache = None
+        self.movedEntities = None
+
+    def relativePositions(self):
+        """
+        entities[stateIndex] - agents, shape (..., numAgents, K, 2). Once
+        the cache is large, only the rows of moved agents and the columns
+        of moved entities are recomputed, O(moved * numAgents) per refresh
+        """
+
+        if self.relCache is None:
+            self.relCache = np.take(self.entities, self.stateIndex, axis=-2)
+            self.relCache -= self.agents[..., None, :]
+            self.movedEntities = np.zeros(self.entities.shape[:-1],
+                                          dtype=bool)
+
+            return self.relCache
+
+        moved = self.movedEntities
+        numMoved = np.count_nonzero(moved)
+        if numMoved == 0:
+            return self.relCache
+
+        #  Small caches, or many moved entities, are cheaper to redo whole.
+        #  An incremental update costs about ten times more per entry
+        numUpdates = numMoved * (self.numAgents + self.stateIndex.shape[1])
+        if self.relCache.size < self.fullRefreshSize or \
+                20 * numUpdates > self.relCache.size:
+            np.take(self.entities, self.stateIndex, axis=-2,
+                    out=self.relCache)
+            self.relCache -= self.agents[..., None, :]
+            moved[...] = False
+
+            return self.relCache
+
+        #  Batched worlds are flattened into one list of worlds, and every
+        #  update is a flat take / put, much cheaper than fancy indexing
+        numEntities = self.entities.shape[-2]
+        numObs = self.stateIndex.shape[1]
+        world, entity = np.nonzero(moved.reshape(-1, numEntities))
+
+        #  Columns of moved entities, in every row that sees them
+        columns = self.columnIndex()[entity]
+        row, seenBy = np.nonzero(columns >= 0)
+        colTargets = (world[row] * self.numAgents + seenBy) * numObs + \
+            columns[row, seenBy]
+        colSources = world[row] * numEntities + entity[row]
+        colOwners = world[row] * numEntities + seenBy
+
+        #  Whole rows of moved agents
+        isAgent = entity < self.numAgents
+        world, agent = world[isAgent], entity[isAgent]
+        rowTargets = (world * self.numAgents + agent)[:, None] * numObs + \
+            np.arange(numObs)
+        rowSources = (world * numEntities)[:, None] + self.stateIndex[agent]
+        rowOwners = np.broadcast_to((world * numEntities + agent)[:, None],
+                                    rowSources.shape)
+
+        #  Cells as indices into the flattened (x, y) arrays
+        xy = np.arange(2)
+        targets = np.concatenate([colTargets, rowTargets.reshape(-1)])
+        sources = np.concatenate([colSources, rowSources.reshape(-1)])
+        owners = np.concatenate([colOwners, rowOwners.reshape(-1)])
+
+        entities = self.entities.reshape(-1)
+        values = np.take(entities, (2 * sources)[:, None] + xy)
+        values -= np.take(entities, (2 * owners)[:, None] + xy)
+        np.put(self.relCache, (2 * targets)[:, None] + xy, values)
+
+        moved[...] = False
+
+        return self.relCache
+
+    def getState(self, agentNum, addId=True):
+        """
+        State is the relative positions of all other Landmarks and agents,
+        served from the relative position cache
+        """
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+
+        rel = self.relativePositions()[..., agentNum, :, :]
+        batchShape = rel.shape[:-2]
+        relPositions = [rel.reshape(batchShape + (-1,)),
+                        self.agents[..., agentNum, :]]
+
+        if addId:
+            relPositions.append(np.full(batchShape + (1,), agentNum))
+
+        state = np.concatenate(relPositions, axis=-1, dtype=np.int_)
+
+        if profiler is not None:
+            profiler.lap("getState", start)
+
+        return state
+
+    def stateShape(self, addId=True):
+        numObs = self.stateIndex.shape[1]
+        return self.agents.shape[:-1] + (2 * numObs + 2 + int(addId),)
+
+    def randomPositions(self, shape, high=None, rng=None):
+        """
+        Uniformly random cells from rng (self.rng by default), as a
+        position array of shape (*shape, 2)
+        """
+
+        if high is None:
+            high = self.gridSize
+        if rng is None:
+            rng = self.rng
+
+        return rng.integers(low=0, high=high, size=np.append(shape, 2),
+                            dtype=self.positionDtype)
+
+    def moveAgents(self, actions):
+        """
+        Moves all agents in place with one gather-add-mod over self.agents
+        """
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+
+        actions = np.asarray(actions)
+        if actions.shape != self.agents.shape[:-1]:
+            raise ValueError("Action size is incorrect")
+        if actions.size and (actions.min() < self.NOOP or
+                             actions.max() > self.DOWN):
+            raise ValueError("Invalid action")
+
+        if profiler is not None:
+            start = profiler.lap("validate", start)
+
+        if self.moveBuffer is None or \
+                self.moveBuffer.shape != self.agents.shape:
+            self.moveBuffer = np.empty_like(self.agents)
+
+        np.take(self.moveDeltas, actions, axis=0, out=self.moveBuffer)
+        self.agents += self.moveBuffer
+        np.remainder(self.agents, self.gridSize, out=self.agents)
+
+        if self.movedEntities is not None:
+            self.movedEntities[..., :self.agents.shape[-2]] |= \
+                actions != self.NOOP
+
+        if profiler is not None:
+            profiler.lap("move", start)
+
+    def getAllStates(self, addId=True, out=None):
+        """
+        getState of every agent stacked into one (numAgents, obsDim) matrix,
+        filled into out when a preallocated buffer is given
+        """
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+
+        if out is None:
+            out = np.empty(self.stateShape(addId), dtype=np.int_)
+        elif out.shape != self.stateShape(addId):
+            raise ValueError("State buffer has the wrong shape")
+
+        gathered = self.relativePositions()
+
+        numCols = gathered.shape[-2] * 2
+        out[..., :numCols] = gathered.reshape(gathered.shape[:-2] +
+                                              (numCols,))
+        out[..., numCols:numCols + 2] = self.agents
+
+        if addId:
+            out[..., -1] = np.arange(self.numAgents)
+
+        if profiler is not None:
+            profiler.lap("getAllStates", start)
+
+        return out
+
+    def entityChannels(self):
+        """
+        Channel of every row of self.entities, 0 for agents
+        """
+
+        return (np.arange(self.entities.shape[-2]) >=
+                self.numAgents).astype(np.intp)
+
+    def nearestShape(self, k, addId=True):
+        return self.agents.shape[:-1] + (3 * k + 2 + int(addId),)
+
+    def getNearestStates(self, k, addId=True):
+        """
+        Observation of every agent restricted to the k nearest entities of
+        getState by torus distance, nearest first (ties by getState order).
+        Each entity is its shortest signed offset on the torus followed by
+        its channel, then come the own position and the id. Shape
+        (..., numAgents, 3 * k + 2 + addId). Crowded grids are searched
+        outward cell by cell with gridNearest, sparse ones whole with
+        denseNearest
+        """
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+
+        numObs = self.stateIndex.shape[1]
+        if not 0 < k <= numObs:
+            raise ValueError("k must be between 1 and %d" % numObs)
+
+        #  The outward search covers about k * cells / entities cells per
+        #  agent, the dense one all numObs entities it sees
+        numCells = self.gridSize * self.gridSize
+        numEntities = self.entities.shape[-2]
+        if self.gridNearestCost * k * numCells < numObs * numEntities:
+            entity, offsets = self.gridNearest(k)
+        else:
+            entity, offsets = self.denseNearest(k)
+
+        channels = self.entityChannels()[entity]
+        entries = np.concatenate([offsets, channels[..., None]], axis=-1)
+
+        out = np.empty(self.nearestShape(k, addId), dtype=np.int_)
+        out[..., :3 * k] = entries.reshape(entries.shape[:-2] + (-1,))
+        out[..., 3 * k:3 * k + 2] = self.agents
+
+        if addId:
+            out[..., -1] = np.arange(self.numAgents)
+
+        if profiler is not None:
+            profiler.lap("getNearestStates", start)
+
+        return out
+
+    def denseNearest(self, k):
+        """
+        Entities and signed offsets of the k nearest, shapes
+        (..., numAgents, k) and (..., numAgents, k, 2), from all of
+        relativePositions, O(numAgents * numObs)
+        """
+
+        numObs = self.stateIndex.shape[1]
+        half = self.gridSize // 2
+        offsets = (self.relativePositions() + half) % self.gridSize - half
+        dist = np.absolute(offsets[..., 0]) + np.absolute(offsets[..., 1])
+
+        #  Unique keys, so the k smallest and their order are well defined
+        keys = dist.astype(np.int64) * numObs + np.arange(numObs)
+        nearest = np.argpartition(keys, k - 1, axis=-1)[..., :k]
+        order = np.argsort(np.take_along_axis(keys, nearest, axis=-1),
+                           axis=-1)
+        nearest = np.take_along_axis(nearest, order, axis=-1)
+
+        entity = np.take_along_axis(
+            np.broadcast_to(self.stateIndex, keys.shape), nearest, axis=-1)
+
+        return entity, np.take_along_axis(offsets, nearest[..., None],
+                                          axis=-2)
+
+    def gridNearest(self, k):
+        """
+        denseNearest by searching outward from every agent over the cells
+        at torus distance 0, 1, 2, ... until k entities it sees are found.
+        Entities are looked up in their cell through the sorted cell
+        indices, so the work grows with the cells and entities searched,
+        not with numAgents * numObs
+        """
+
+        G = self.gridSize
+        numCells = G * G
+        numAgents = self.numAgents
+        numEntities = self.entities.shape[-2]
+        batchShape = self.agents.shape[:-2]
+        numWorlds = int(np.prod(batchShape))
+        numObs = self.stateIndex.shape[1]
+        columns = self.columnIndex()
+
+        if self.torusRings is None or len(self.torusRings[0]) != numCells:
+            self.torusRings = torusRings(G)
+        ringOffsets, ringStarts = self.torusRings
+
+        #  Entities sorted by world, then cell
+        keys = cellIndex(self.entities.reshape(numWorlds, numEntities, 2), G)
+        keys = (keys + (np.arange(numWorlds) * numCells)[:, None]).reshape(-1)
+        order = np.argsort(keys, kind="stable")
+        sortedKeys = keys[order]
+
+        agents = self.agents.reshape(-1, 2).astype(np.intp)
+        worldBase = np.repeat(np.arange(numWorlds) * numCells, numAgents)
+        found = np.zeros(len(agents), dtype=np.intp)
+        active = np.arange(len(agents))
+        hits = []
+
+        for ring in range(len(ringStarts) - 1):
+            if not len(active):
+                break
+
+            offsets = ringOffsets[ringStarts[ring]:ringStarts[ring + 1]]
+            cells = (agents[active, None, :] + offsets) % G
+            cellKeys = worldBase[active, None] + cells[..., 0] * G + \
+                cells[..., 1]
+
+            first = np.searchsorted(sortedKeys, cellKeys, side="left")
+            counts = np.searchsorted(sortedKeys, cellKeys, side="right") - \
+                first
+
+            #  One entry per entity in a searched cell
+            counts = counts.reshape(-1)
+            total = int(counts.sum())
+            if total:
+                pair = np.repeat(np.arange(counts.size), counts)
+                within = np.arange(total) - np.repeat(
+                    np.cumsum(counts) - counts, counts)
+                source = order[first.reshape(-1)[pair] + within]
+
+                agent = active[pair // len(offsets)]
+                entity = source % numEntities
+                column = columns[entity, agent % numAgents]
+                seen = column >= 0
+
+                agent = agent[seen]
+                hits.append((agent, column[seen], entity[seen],
+                             np.full(len(agent), ring),
+                             offsets[pair[seen] % len(offsets)]))
+                found += np.bincount(agent, minlength=len(found))
+
+            active = active[found[active] < k]
+
+        agent, column, entity, dist, offsets = [
+            np.concatenate(parts) for parts in zip(*hits)]
+
+        #  The k smallest (distance, column) of every agent
+        rank = np.lexsort((column, dist, agent))
+        agent = agent[rank]
+        firstHit = np.searchsorted(agent, np.arange(len(agents)))
+        pick = (firstHit[:, None] + np.arange(k)).reshape(-1)
+
+        half = G // 2
+        offsets = (offsets[rank[pick]] + half) % G - half
+
+        return (entity[rank[pick]].reshape(batchShape + (numAgents, k)),
+                offsets.reshape(batchShape + (numAgents, k, 2)))
+
+    def localShape(self, radius):
+        size = 2 * radius + 1
+        return self.agents.shape[:-1] + (len(self.channelNames), size, size)
+
+    def getLocalStates(self, radius):
+        """
+        Egocentric window of every agent, shape (..., numAgents, C,
+        2 * radius + 1, 2 * radius + 1). Channel c counts the entities of
+        channelNames[c] in each cell around the agent, wrapping around the
+        torus. The agent itself is left out of its own window
+        """
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+
+        G = self.gridSize
+        batchShape = self.agents.shape[:-2]
+        numWorlds = int(np.prod(batchShape))
+        size = 2 * radius + 1
+
+        #  Cell index of every window entry, one row of windows per world
+        offsets = np.arange(-radius, radius + 1)
+        agents = self.agents.reshape(numWorlds, self.numAgents, 2)
+        rows = (agents[..., 0, None] + offsets) % G
+        cols = (agents[..., 1, None] + offsets) % G
+        cells = rows[..., :, None] * G + cols[..., None, :]
+
+        #  Windows wider than the grid see the own cell more than once
+        ownCell = cells == cells[..., radius, radius, None, None]
+        cells = cells.reshape(numWorlds, -1)
+
+        out = np.empty((numWorlds, self.numAgents, len(self.channelNames),
+                        size, size), dtype=np.int_)
+        channels = self.entityChannels()
+        for c in range(len(self.channelNames)):
+            grid = occupancy(self.entities[..., channels == c, :], G)
+            grid = grid.reshape(numWorlds, -1)
+            out[:, :, c] = np.take_along_axis(grid, cells, axis=1).reshape(
+                numWorlds, self.numAgents, size, size)
+
+        out[:, :, 0] -= ownCell
+        out = out.reshape(self.localShape(radius))
+
+        if profiler is not None:
+            profiler.lap("getLocalStates", start)
+
+        return out
+
+    def renderCells(self):
+        """
+        Positions to paint in order, their color ids and the color palette
+        """
+        raise NotImplementedError
+
+    def render(self, mode="rgb_array"):
+        """
+        Returns the current world as an (H, W, 3) uint8 frame, reused by the
+        next call. mode "human" also displays it with matplotlib
+        """
+
+        positions, colorIds, colors = self.renderCells()
+        if self.gridRenderer is None or \
+                self.gridRenderer.gridSize != self.gridSize:
+            self.gridRenderer = GridRenderer(self.gridSize, colors)
+
+        frame = self.gridRenderer.render(positions, colorIds)
+
+        if mode == "human":
+            self.gridRenderer.show(frame)
+        elif mode != "rgb_array":
+            raise ValueError("Unknown render mode " + str(mode))
+
+        return frame
+
+    def visualizeState(self):
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+
+        frame = self.render()
+
+        if self.frameWriter is not None:
+            self.frameWriter.put(frame, self.steps)
+        else:
+            writePng(os.path.join(self.imageDir, str(self.steps) + ".png"),
+                     frame)
+
+        if profiler is not None:
+            profiler.lap("render", start)
+
+    def snapshotSize(self):
+        size = len(self.snapshotScalars)
+        batchDims = self.agents.ndim - 2
+        for name in self.snapshotArrays:
+            size += int(np.prod(getattr(self, name).shape[batchDims:]))
+
+        return size
+
+    def get_snapshot(self, out=None):
+        """
+        World state packed into one flat int32 array, snapshotScalars
+        followed by snapshotArrays. Batched envs give one row per world.
+        RNG state is not included
+        """
+
+        batchShape = self.agents.shape[:-2]
+        parts = [np.reshape(getattr(self, name), batchShape + (-1,))
+                 for name in self.snapshotScalars + self.snapshotArrays]
+
+        if out is None:
+            return np.concatenate(parts, axis=-1, dtype=np.int32)
+
+        return np.concatenate(parts, axis=-1, out=out)
+
+    def set_snapshot(self, snapshot, worlds=None):
+        """
+        Restores a get_snapshot array in place. Batched envs take one row
+        per world, written to the worlds given (all worlds by default)
+        """
+
+        snapshot = np.asarray(snapshot)
+        batchDims = self.agents.ndim - 2
+        if worlds is None:
+            worlds = Ellipsis
+
+        pos = 0
+        for name in self.snapshotScalars:
+            if batchDims:
+                getattr(self, name)[worlds] = snapshot[..., pos]
+            else:
+                setattr(self, name, int(snapshot[pos]))
+            pos += 1
+
+        for name in self.snapshotArrays:
+            array = getattr(self, name)
+            worldShape = array.shape[batchDims:]
+            size = int(np.prod(worldShape))
+            values = snapshot[..., pos:pos + size]
+            array[worlds] = values.reshape(values.shape[:-1] + worldShape)
+            pos += size
+
+        #  The cache buffer is kept, the next read refreshes the worlds
+        #  written and the others keep their cached rows
+        if self.movedEntities is None:
+            self.invalidateCache()
+        else:
+            self.movedEntities[worlds] = True
+
+    def startSnapshots(self, entities, rng):
+        """
+        get_snapshot rows of new episodes with entities of shape
+        (num, numEntities, 2) and the rest of the state as reset_world
+        leaves it
+        """
+
+        rows = np.zeros((len(entities), self.snapshotSize()), dtype=np.int32)
+
+        pos = len(self.snapshotScalars)
+        batchDims = self.agents.ndim - 2
+        for name in self.snapshotArrays:
+            size = int(np.prod(getattr(self, name).shape[batchDims:]))
+            if name == "entities":
+                rows[:, pos:pos + size] = entities.reshape(len(entities), -1)
+            pos += size
+
+        return rows
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import colorsys
+import struct
+import zlib
+import numpy as np
+
+
+def hexToRgb(color):
+    return [int(color[i:i + 2], 16) for i in (1, 3, 5)]
+
+
+def extendPalette(colors, numColors):
+    """
+    colors as an RGB array, padded with well separated hues when more than
+    len(colors) colors are needed
+    """
+
+    palette = [hexToRgb(c) for c in colors[:numColors]]
+    for i in range(len(palette), numColors):
+        hue = (i * 0.618033988749895) % 1.0
+        rgb = colorsys.hsv_to_rgb(hue, 0.65, 0.85)
+        palette.append([int(255 * c) for c in rgb])
+
+    return np.array(palette, dtype=np.uint8).reshape(-1, 3)
+
+
+def encodePng(frame, level=6):
+    """
+    PNG bytes of an (H, W, 3) uint8 frame
+    """
+
+    height, width = frame.shape[:2]
+    rows = np.zeros((height, 1 + 3 * width), dtype=np.uint8)
+    rows[:, 1:] = frame.reshape(height, -1)
+
+    def chunk(tag, data):
+        body = tag + data
+        return (struct.pack(">I", len(data)) + body +
+                struct.pack(">I", zlib.crc32(body) & 0xffffffff))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) +
+            chunk(b"IDAT", zlib.compress(rows.tobytes(), level)) +
+            chunk(b"IEND", b""))
+
+
+def writePng(path, frame, level=6):
+    with open(path, "wb") as f:
+        f.write(encodePng(frame, level))
+
+
+class GridRenderer(object):
+    """
+    Paints grid worlds straight into preallocated (H, W, 3) uint8 frames.
+    Cells are cellSize pixels wide and separated by lineWidth black lines
+    """
+
+    BACKGROUND = 0
+    LINE = 1
+
+    def __init__(self, gridSize, colors, cellSize=16, lineWidth=2):
+        self.gridSize = gridSize
+        self.colors = list(colors)
+        self.cellSize = cellSize
+        self.lineWidth = lineWidth
+        self.period = cellSize + lineWidth
+        self.size = gridSize * self.period + lineWidth
+
+        self.palette = None
+        self.grid = None
+        self.cellColors = None
+        self.frame = None
+        self.cells = None
+        self.figure = None
+
+    def setNumColors(self, numColors):
+        if self.palette is None or len(self.palette) != numColors + 2:
+            self.palette = np.concatenate([
+                np.array([[255, 255, 255], [0, 0, 0]], dtype=np.uint8),
+                extendPalette(self.colors, numColors)])
+
+    def allocate(self, batchShape):
+        """
+        Frames of batchShape with their grid lines painted, and a view of
+        their cells as (..., G, cellSize, G, cellSize, 3) blocks
+        """
+
+        G = self.gridSize
+        self.frame = np.empty(batchShape + (self.size, self.size, 3),
+                              dtype=np.uint8)
+        self.frame[...] = self.palette[self.LINE]
+
+        #  Each block is lineWidth rows of line, then cellSize of cell
+        blocks = self.frame[..., :G * self.period, :G * self.period, :]
+        blocks = blocks.reshape(batchShape + (G, self.period,
+                                              G, self.period, 3))
+        self.cells = blocks[..., self.lineWidth:, :, self.lineWidth:, :]
+        self.cellColors = np.empty(batchShape + (G, G, 3), dtype=np.uint8)
+
+    def render(self, positions, colorIds):
+        """
+        Paints positions (..., k, 2) in order with palette entries colorIds
+        (k,), later entries covering earlier ones. Leading dimensions give a
+        batch of frames. The returned frame is reused by the next call
+        """
+
+        positions = np.asarray(positions)
+        colorIds = np.asarray(colorIds)
+        batchShape = positions.shape[:-2]
+        self.setNumColors(int(colorIds.max(initial=-1)) + 1)
+
+        gridShape = batchShape + (self.gridSize, self.gridSize)
+        dtype = np.min_scalar_type(len(self.palette) - 1)
+        if self.grid is None or self.grid.shape != gridShape or \
+                self.grid.dtype != dtype:
+            self.grid = np.empty(gridShape, dtype=dtype)
+        if self.frame is None or self.frame.shape[:-3] != batchShape:
+            self.allocate(batchShape)
+
+        self.grid.fill(self.BACKGROUND)
+        ids = np.broadcast_to(colorIds + 2, positions.shape[:-1])
+        worlds = np.indices(batchShape + (1,))[:-1]
+        self.grid[tuple(worlds) + (positions[..., 0], positions[..., 1])] = ids
+
+        #  Lines were painted with the frame, only cells are filled
+        np.take(self.palette, self.grid, axis=0, out=self.cellColors)
+        self.cells[...] = self.cellColors[..., :, None, :, None, :]
+
+        return self.frame
+
+    def show(self, frame):
+        """
+        Displays frame in a matplotlib window, updated in place
+        """
+
+        import matplotlib.pyplot as plt
+
+        if self.figure is None or not plt.fignum_exists(self.figure.number):
+            self.figure, ax = plt.subplots(1, 1, tight_layout=True)
+            self.image = ax.imshow(frame, interpolation="none")
+            ax.axis("off")
+        else:
+            self.image.set_data(frame)
+
+        plt.pause(0.001)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+
+
+class PhaseStats(object):
+    """
+    Wall time and call counts accumulated per phase of act and getState.
+    Attach with env.profiler = PhaseStats(), phases are timed only while a
+    profiler is attached
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.times = {}
+        self.calls = {}
+
+    def clock(self):
+        return time.perf_counter()
+
+    def lap(self, phase, start):
+        """
+        Charges the time since start to phase and returns the current time
+        """
+
+        now = time.perf_counter()
+        self.times[phase] = self.times.get(phase, 0.0) + now - start
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+        return now
+
+    def summary(self):
+        return {phase: {"seconds": self.times[phase],
+                        "calls": self.calls[phase],
+                        "meanUs": 1e6 * self.times[phase] / self.calls[phase]}
+                for phase in self.times}
+
+    def dump(self, stream=sys.stdout):
+        total = sum(self.times.values()) or 1.0
+        stream.write("%-14s %10s %10s %10s %6s\n" %
+                     ("phase", "calls", "seconds", "us/call", "%"))
+        for phase in sorted(self.times, key=self.times.get, reverse=True):
+            stream.write("%-14s %10d %10.4f %10.2f %6.1f\n" % (
+                phase, self.calls[phase], self.times[phase],
+                1e6 * self.times[phase] / self.calls[phase],
+                100.0 * self.times[phase] / total))
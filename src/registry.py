@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import importlib
+
+
+#  name -> (module, class). Modules are imported by the first make of the
+#  domain, so a worker only loads the domain it runs
+DOMAINS = {
+    "simple_reference": ("simple_reference.env", "GridEnv"),
+    "simple_reference_vec": ("simple_reference.env", "VecGridEnv"),
+    "simple_cover": ("simple_cover.env", "GridEnv"),
+    "simple_chaser": ("simple_chaser.env", "GridEnv"),
+    "simple_speaker_listener": ("simple_speaker_listener.env", "GridEnv"),
+}
+
+
+#  Domains whose envs step many worlds at once, they cannot be pooled by
+#  SubprocVecEnv or EnvServer
+BATCHED = {"simple_reference_vec"}
+
+
+def register(name, moduleName, className="GridEnv", batched=False):
+    DOMAINS[name] = (moduleName, className)
+    if batched:
+        BATCHED.add(name)
+    else:
+        BATCHED.discard(name)
+
+
+def singleDomains():
+    """
+    Names of the registered domains with one world per env
+    """
+
+    return sorted(set(DOMAINS) - BATCHED)
+
+
+def checkSingle(name):
+    if name in BATCHED:
+        raise ValueError("%s is a batched domain, env pools need one world "
+                         "per env, use one of %s" %
+                         (name, ", ".join(singleDomains())))
+
+
+def envClass(name):
+    """
+    Env class of the registered domain name, importing only its module
+    """
+
+    if name not in DOMAINS:
+        raise ValueError("Unknown domain %s, registered domains are %s" %
+                         (name, ", ".join(sorted(DOMAINS))))
+
+    moduleName, className = DOMAINS[name]
+
+    return getattr(importlib.import_module(moduleName), className)
+
+
+def make(name, **kwargs):
+    """
+    New env of domain name, e.g. make("simple_chaser", gridSize=10,
+    nAgents=4)
+    """
+
+    return envClass(name)(**kwargs)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+def compactDtype(env):
+    """
+    Smallest signed integer type holding every observation entry of env:
+    relative positions in (-gridSize, gridSize), agent ids and, for
+    speaker_listener, the target landmark
+    """
+
+    if hasattr(env, "landMarksNum"):
+        largest = max(env.gridSize, env.landMarksNum)
+    else:
+        largest = max(env.gridSize, env.numAgents)
+    for dtype in (np.int8, np.int16, np.int32):
+        if largest <= np.iinfo(dtype).max:
+            return dtype
+
+    return np.int64
+
+
+class SumTree(object):
+    """
+    Binary tree of capacity non-negative leaf values in one array, each
+    node holding the sum of its children. Updating B leaves and drawing B
+    leaves in proportion to their values both cost O(B log capacity)
+    """
+
+    def __init__(self, capacity):
+        self.numLeaves = 1
+        while self.numLeaves < capacity:
+            self.numLeaves *= 2
+        self.depth = self.numLeaves.bit_length() - 1
+
+        #  Node i has children 2i and 2i + 1, the root is node 1
+        self.nodes = np.zeros(2 * self.numLeaves, dtype=np.float64)
+
+    @property
+    def total(self):
+        return self.nodes[1]
+
+    def __getitem__(self, leaves):
+        return self.nodes[self.numLeaves + leaves]
+
+    def update(self, leaves, values):
+        nodes = self.numLeaves + np.asarray(leaves)
+        self.nodes[nodes] = values
+
+        #  Sums are recomputed from the children, so no error accumulates
+        for level in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes] + \
+                self.nodes[2 * nodes + 1]
+
+    def find(self, targets):
+        """
+        Leaf of each of targets in [0, total) when the leaf values are laid
+        end to end
+        """
+
+        targets = np.array(targets, dtype=np.float64)
+        nodes = np.ones(len(targets), dtype=np.intp)
+        for level in range(self.depth):
+            left = 2 * nodes
+            leftSums = self.nodes[left]
+            right = targets >= leftSums
+            targets -= np.where(right, leftSums, 0.0)
+            nodes = left + right
+
+        return nodes - self.numLeaves
+
+
+class ReplayBuffer(object):
+    """
+    Ring buffer of joint transitions sized from env: states and next states
+    of shape (nAgents, obsDim) in a compact integer dtype, joint actions and
+    rewards. Batched envs are added one row per world with addBatch.
+    Prioritized sampling keeps priority ** alpha in a SumTree
+    """
+
+    def __init__(self, env, capacity, addId=True, alpha=0.6, seed=None):
+        stateShape = env.stateShape(addId)[-2:]
+        actionShape = env.agents.shape[-2:-1]
+
+        self.capacity = capacity
+        self.addId = addId
+        self.alpha = alpha
+        self.rng = np.random.default_rng(seed)
+        self.dtype = compactDtype(env)
+
+        self.states = np.zeros((capacity,) + stateShape, dtype=self.dtype)
+        self.nextStates = np.zeros((capacity,) + stateShape,
+                                   dtype=self.dtype)
+        self.actions = np.zeros((capacity,) + actionShape, dtype=np.int8)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.priorities = np.zeros(capacity, dtype=np.float64)
+        self.tree = SumTree(capacity)
+
+        self.position = 0
+        self.size = 0
+        self.maxPriority = 1.0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, actions, reward, nextState):
+        self.addBatch(np.asarray(state)[None], np.asarray(actions)[None],
+                      np.atleast_1d(reward), np.asarray(nextState)[None])
+
+    def addBatch(self, states, actions, rewards, nextStates):
+        """
+        Adds B transitions at once, states of shape (B, nAgents, obsDim)
+        """
+
+        count = len(rewards)
+        if count > self.capacity:
+            states, actions = states[-self.capacity:], actions[-self.capacity:]
+            rewards = rewards[-self.capacity:]
+            nextStates = nextStates[-self.capacity:]
+            count = self.capacity
+
+        rows = (self.position + np.arange(count)) % self.capacity
+        self.states[rows] = states
+        self.nextStates[rows] = nextStates
+        self.actions[rows] = np.reshape(actions, (count,) +
+                                        self.actions.shape[1:])
+        self.rewards[rows] = rewards
+        self.priorities[rows] = self.maxPriority
+        self.tree.update(rows, self.maxPriority ** self.alpha)
+
+        self.position = (self.position + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+
+    def batch(self, rows):
+        return (self.states[rows], self.actions[rows], self.rewards[rows],
+                self.nextStates[rows])
+
+    def sample(self, batchSize):
+        """
+        Uniform batch of (states, actions, rewards, nextStates), plus the
+        sampled rows
+        """
+
+        if self.size == 0:
+            raise ValueError("Cannot sample from an empty buffer")
+
+        rows = self.rng.integers(0, self.size, size=batchSize)
+
+        return self.batch(rows) + (rows,)
+
+    def samplePrioritized(self, batchSize, beta=0.4):
+        """
+        Batch drawn with probability proportional to priority ** alpha, plus
+        the sampled rows and their importance sampling weights
+        """
+
+        if self.size == 0:
+            raise ValueError("Cannot sample from an empty buffer")
+
+        total = self.tree.total
+        targets = self.rng.uniform(0, total, size=batchSize)
+        rows = np.minimum(self.tree.find(targets), self.size - 1)
+
+        probabilities = self.tree[rows] / total
+        isWeights = (self.size * probabilities) ** -beta
+        isWeights /= isWeights.max()
+
+        return self.batch(rows) + (rows, isWeights)
+
+    def updatePriorities(self, rows, priorities):
+        priorities = np.abs(priorities) + 1e-6
+        self.priorities[rows] = priorities
+        self.tree.update(rows, priorities ** self.alpha)
+        self.maxPriority = max(self.maxPriority, float(priorities.max()))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+import threading
+import numpy as np
+from gridEnvironment import cellIndex, torusDistance
+
+
+class ResetBank(object):
+    """
+    size start states of env's domain drawn ahead of time, served in order
+    by copying rows into an env with set_snapshot. Entity positions are
+    rejection sampled in bulk so that every two entities are at least
+    minDistance apart on the torus, 1 for distinct cells and 0 for none.
+    The next bank is drawn in a background thread while this one is
+    served (or when it runs out, with background=False). An error in the
+    background draw is raised by the swap that needed its bank. Attach
+    with env.resetBank = ResetBank(env)
+    """
+
+    #  Candidates checked per vectorized rejection pass
+    chunkSize = 4096
+
+    def __init__(self, env, size=65536, minDistance=0, seed=None,
+                 background=True, maxAttempts=1000):
+        self.env = env
+        self.size = size
+        self.minDistance = minDistance
+        self.background = background
+        self.maxAttempts = maxAttempts
+        self.rng = np.random.default_rng(seed)
+
+        self.gridSize = env.gridSize
+        self.numEntities = env.entities.shape[-2]
+        if minDistance >= 1 and \
+                self.numEntities > self.gridSize * self.gridSize:
+            raise ValueError("%d entities do not fit in distinct cells" %
+                             self.numEntities)
+
+        self.rows = self.sample(size)
+        self.next = 0
+
+        self.refill = None
+        self.nextRows = None
+        self.error = None
+        if background:
+            self.startRefill()
+
+    def accept(self, positions):
+        """
+        Whether every candidate of positions, shape (num, numEntities, 2),
+        meets minDistance
+        """
+
+        if self.minDistance <= 0 or self.numEntities < 2:
+            return np.ones(len(positions), dtype=bool)
+
+        if self.minDistance == 1:
+            #  Distinct cells, repeats are neighbours once sorted
+            cells = np.sort(cellIndex(positions, self.gridSize), axis=-1)
+            return np.all(cells[:, 1:] != cells[:, :-1], axis=-1)
+
+        distances = torusDistance(positions[:, :, None, :],
+                                  positions[:, None, :, :], self.gridSize)
+        pairs = np.triu_indices(self.numEntities, 1)
+
+        return np.all(distances[:, pairs[0], pairs[1]] >= self.minDistance,
+                      axis=-1)
+
+    def sample(self, num):
+        """
+        num new start states as get_snapshot rows
+        """
+
+        found = []
+        numFound = 0
+        for attempt in range(self.maxAttempts):
+            if numFound >= num:
+                break
+
+            positions = self.env.randomPositions(
+                (self.chunkSize, self.numEntities), rng=self.rng)
+            positions = positions[self.accept(positions)]
+            found.append(positions)
+            numFound += len(positions)
+        else:
+            if numFound < num:
+                raise ValueError("Found %d of %d start states, minDistance "
+                                 "%d is too strict" %
+                                 (numFound, num, self.minDistance))
+
+        entities = np.concatenate(found)[:num]
+
+        return self.env.startSnapshots(entities, self.rng)
+
+    def startRefill(self):
+        def work():
+            try:
+                self.nextRows = self.sample(self.size)
+            except Exception as error:
+                self.error = error
+
+        self.refill = threading.Thread(target=work, daemon=True)
+        self.refill.start()
+
+    def swap(self):
+        if self.refill is None:
+            self.rows = self.sample(self.size)
+        else:
+            self.refill.join()
+            self.refill = None
+            self.checkError()
+            self.rows = self.nextRows
+            self.nextRows = None
+        #  After a failed refill the next bank is drawn here first
+        if self.background:
+            self.startRefill()
+        self.next = 0
+
+    def checkError(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Reset bank refill failed") from error
+
+    def take(self, num=None):
+        """
+        The next num start states, shape (num, snapshotSize), or a single
+        row when num is None
+        """
+
+        if num is None:
+            return self.take(1)[0]
+
+        rows = np.empty((num, self.rows.shape[1]), dtype=self.rows.dtype)
+        filled = 0
+        while filled < num:
+            if self.next == len(self.rows):
+                self.swap()
+            count = min(num - filled, len(self.rows) - self.next)
+            rows[filled:filled + count] = \
+                self.rows[self.next:self.next + count]
+            filled += count
+            self.next += count
+
+        return rows
+
+    def restore(self, env, worlds=None):
+        """
+        Starts new episodes in env from the bank, in the worlds given or
+        all worlds of a batched env
+        """
+
+        if env.agents.ndim == 2:
+            env.set_snapshot(self.take())
+        elif worlds is None:
+            env.set_snapshot(self.take(len(env.agents)))
+        else:
+            env.set_snapshot(self.take(len(worlds)), worlds)
+
+    def close(self):
+        if self.refill is not None:
+            self.refill.join()
+            self.refill = None
+        self.checkError()
@@ -1,56 +1,51 @@
 #!/usr/bin/env python3
 
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
-from gridEnvironment import MultiAgentGrid
+from gridEnvironment import (MultiAgentGrid, collisionCounts,
+                             coverageReward, nearestDistances)
 
 
 class GridEnv(MultiAgentGrid):
 
-    def __init__(self, gridSize=7, nAgents=2, seed=None):
+    imageDir = "img_chaser"
+    channelNames = ("agents", "prey")
+
+    def __init__(self, gridSize=7, nAgents=2, seed=None, horizon=None):
         self.gridSize = gridSize
         self.numAgents = nAgents
+        self.horizon = horizon
         self.numPrey = int(nAgents / 2)
         self.defineMoves()
+        self.rng = np.random.default_rng(seed)
         self.reset_world(gridSize)
-
-        if seed is not None:
-            np.random.seed(seed)
+        self.stateIndex = self.buildStateIndex()
 
     def reset_world(self, gridsize):
-        self.agents = []
-        self.prey = []
         self.steps = 0
+        self.invalidateCache()
 
-        for i in range(self.numAgents):
-            self.agents.append(np.random.randint(low=0,
-                                                 high=gridsize,
-                                                 size=2))
-        for i in range(self.numPrey):
-            self.prey.append(np.random.randint(low=0,
-                                               high=gridsize,
-                                               size=2))
+        #  Agents followed by prey, both views into self.entities
+        self.entities = self.randomPositions(self.numAgents + self.numPrey,
+                                             gridsize)
+        self.agents = self.entities[:self.numAgents]
+        self.prey = self.entities[self.numAgents:]
 
-        self.agentReached = [False for i in range(self.numAgents)]
+        self.agentReached = np.zeros(self.numAgents, dtype=bool)
 
-    def getState(self, agentNum, addId=True):
-        """
-        State is the relative positions of all other Landmarks and agents
-        """
+    def resetArgs(self):
+        return (self.gridSize,)
 
-        relPositions = []
+    def stateLayout(self):
+        sequence = []
+        owner = []
         for i in range(self.numAgents):
-            if(i != agentNum):
-                relPositions.append(self.agents[i] - self.agents[agentNum])
-            relPositions.append(self.prey[i] - self.agents[agentNum])
-
-        relPositions.append(self.agents[agentNum])
+            sequence.append(i)
+            owner.append(i)
+            if i < self.numPrey:
+                sequence.append(self.numAgents + i)
+                owner.append(-1)
 
-        if addId:
-            relPositions.append([agentNum])
-
-        return np.concatenate(relPositions)
+        return np.array(sequence), np.array(owner)
 
     def act(self, actions, viz=False):
         """
@@ -59,72 +54,43 @@ class GridEnv(MultiAgentGrid):
         Reward of all agets summed together
         """
 
-        if len(actions) != self.numAgents:
-            raise ValueError("Action size is incorrect")
+        # Update states of all agents
+        self.moveAgents(actions)
 
         self.steps += 1
-        reward = 0.0
 
-        # Update states of all agents
-        for ind, act in enumerate(actions):
-            if act == self.NOOP:
-                pass
-            elif act == self.LEFT:
-                self.agents[ind] = (self.agents[ind] + [0, -1] +
-                                    self.gridSize) % self.gridSize
-            elif act == self.RIGHT:
-                self.agents[ind] = (self.agents[ind] + [0, 1] +
-                                    self.gridSize) % self.gridSize
-            elif act == self.DOWN:
-                self.agents[ind] = (self.agents[ind] + [1, 0] +
-                                    self.gridSize) % self.gridSize
-            elif act == self.UP:
-                self.agents[ind] = (self.agents[ind] + [-1, 0] +
-                                    self.gridSize) % self.gridSize
-
-        #  Negative reward proportional to closest landmark
-        for i in range(self.numPrey):
-
-            dist1 = np.min(np.sum(
-                np.absolute(self.agents - self.prey[i]),
-                axis=1))
-
-            dist2 = np.min(
-                np.sum(np.absolute(
-                    np.absolute(self.agents - self.prey[i]) -
-                    [self.gridSize, self.gridSize]),
-                    axis=1))
-
-            dist3 = np.min(
-                np.sum(np.absolute(
-                    np.absolute(self.agents - self.prey[i]) -
-                    [self.gridSize, 0]),
-                    axis=1))
-
-            dist4 = np.min(
-                np.sum(np.absolute(
-                    np.absolute(self.agents - self.prey[i]) -
-                    [0, self.gridSize]),
-                    axis=1))
-
-            dist = min(dist1, dist2, dist3, dist4)
-            reward = reward - dist
-
-            #  Penalize collisions
-            for j in range(self.numAgents):
-                if j != i and (np.sum(self.agents[i] == self.agents[j]) == 2):
-                    reward -= self.gridSize
-
-            reward = reward / self.gridSize
-
-        #  Randomly Move Prey(independent of previous movement)
-        for ind in range(self.numPrey):
-            mv = np.random.randint(0, 2, 2)
-            actPrey = [0, 0]
-            actPrey[mv[0]] = mv[1] * 2 - 1
-
-            self.prey[ind] = (self.prey[ind] + actPrey +
-                              self.gridSize) % self.gridSize
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+
+        collisions = collisionCounts(self.agents, self.gridSize)
+
+        if profiler is not None:
+            start = profiler.lap("collisions", start)
+
+        #  Negative reward proportional to closest agent, and to collisions
+        nearest = nearestDistances(self.prey, self.agents, self.gridSize)
+        reward = coverageReward(nearest, collisions, self.gridSize)[()]
+
+        #  Kept for metrics, see episodeMetrics
+        self.lastCollisions = collisions
+        self.lastDistances = nearest
+
+        if profiler is not None:
+            start = profiler.lap("reward", start)
+
+        #  Randomly Move Prey(independent of previous movement), one
+        #  step along either axis, all prey drawn at once
+        preyMoves = self.rng.integers(0, 4, size=self.numPrey)
+        self.prey += self.moveDeltas[preyMoves + 1]
+        np.remainder(self.prey, self.gridSize, out=self.prey)
+
+        #  Prey always take a step
+        if self.movedEntities is not None:
+            self.movedEntities[self.numAgents:] = True
+
+        if profiler is not None:
+            profiler.lap("prey", start)
 
         #  Visualize new state
         if viz:
@@ -132,22 +98,34 @@ class GridEnv(MultiAgentGrid):
 
         return reward
 
-    def visualizeState(self):
-        if self.numAgents >= 6:
-            raise ValueError("Visualization works for only if No." +
-                             "of Agents < 6")
+    def sequenceRewards(self, trajectory, numPlans):
+        """
+        Prey moves of all T steps come from one draw, which leaves the
+        Generator where T calls of act would. Plans share these moves
+        """
 
-        N = self.gridSize
-        # make an empty data set
-        data = np.ones((N, N)) * np.nan
+        numSteps = trajectory.shape[-3]
+        preyMoves = self.rng.integers(0, 4, size=(numSteps, self.numPrey))
+        deltas = self.moveDeltas[preyMoves + 1].astype(np.int64)
+        travelled = np.cumsum(deltas, axis=0)
 
-        for i in range(self.numAgents):
-            x1, y1 = self.agents[i]
-            data[x1][y1] = i + 1
+        #  Rewards see the prey before they take the step of their turn
+        prey = (self.prey + travelled - deltas) % self.gridSize
+
+        collisions = collisionCounts(trajectory, self.gridSize)
+        nearest = nearestDistances(prey, trajectory, self.gridSize)
+        rewards = coverageReward(nearest, collisions, self.gridSize)
+
+        entities = self.finalEntities(trajectory)
+        entities[..., self.numAgents:, :] = (self.prey + travelled[-1]) % \
+            self.gridSize
+
+        return rewards, {"entities": entities}
 
-        for i in range(self.numPrey):
-            x2, y2 = self.prey[i]
-            data[x2][y2] = 0
+    def renderCells(self):
+        #  Agent i in color i + 1, then all prey in color 0
+        colorIds = np.zeros(self.numAgents + self.numPrey, dtype=int)
+        colorIds[:self.numAgents] = np.arange(1, self.numAgents + 1)
 
         colors = [
             '#566573',
@@ -157,22 +135,4 @@ class GridEnv(MultiAgentGrid):
             '#1ABC9C',
             '#F4D03F']
 
-        colors = colors[0: self.numAgents + 1]
-
-        # make a figure + axes
-        fig, ax = plt.subplots(1, 1, tight_layout=True)
-        # make color map
-        my_cmap = matplotlib.colors.ListedColormap(colors)
-        # set the 'bad' values (nan) to be white and transparent
-        my_cmap.set_bad(color='w', alpha=0)
-        # draw the grid
-        for x in range(N + 1):
-            ax.axhline(x, lw=2, color='k', zorder=5)
-            ax.axvline(x, lw=2, color='k', zorder=5)
-        # draw the boxes
-        ax.imshow(data, interpolation='none', cmap=my_cmap,
-                  extent=[0, N, 0, N], zorder=0)
-        # turn off the axis labels
-        ax.axis('off')
-        plt.savefig("img_chaser/" + str(self.steps) + ".png")
-        plt.close()
+        return self.entities, colorIds, colors
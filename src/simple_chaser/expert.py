@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from gridEnvironment import greedyActions, greedyAssignment, torusDistance
+
+
+def expertActions(agents, prey, gridSize):
+    """
+    Greedy simple_chaser policy, every agent steps towards its assigned
+    prey, nearest pairs assigned first. Each prey takes up to
+    ceil(nAgents / numPrey) agents, so every agent has one. agents and
+    prey have shape (..., nAgents, 2) and (..., numPrey, 2), any leading
+    dimensions are worlds, and the actions (..., nAgents)
+    """
+
+    numAgents = agents.shape[-2]
+    numPrey = prey.shape[-2]
+    if numPrey == 0:
+        return np.zeros(agents.shape[:-1], dtype=np.int8)
+
+    distances = torusDistance(agents[..., :, None, :],
+                              prey[..., None, :, :], gridSize)
+
+    #  Slots of the same prey are adjacent, slot s belongs to prey
+    #  s // slotsPerPrey
+    slotsPerPrey = -(-numAgents // numPrey)
+    slots = greedyAssignment(np.repeat(distances, slotsPerPrey, axis=-1))
+    goals = np.take_along_axis(prey, (slots // slotsPerPrey)[..., None],
+                               axis=-2)
+
+    return greedyActions(agents, goals, gridSize)
+
+
+def expertPolicy(env):
+    return expertActions(env.agents, env.prey, env.gridSize)
@@ -1,55 +1,43 @@
 #!/usr/bin/env python3
 
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
-from gridEnvironment import MultiAgentGrid
+from gridEnvironment import (MultiAgentGrid, collisionCounts,
+                             coverageReward, nearestDistances)
 
 
 class GridEnv(MultiAgentGrid):
 
-    def __init__(self, gridSize=7, nAgents=2, seed=None):
+    imageDir = "img_cover"
+
+    def __init__(self, gridSize=7, nAgents=2, seed=None, horizon=None):
         self.gridSize = gridSize
         self.numAgents = nAgents
+        self.horizon = horizon
         self.defineMoves()
+        self.rng = np.random.default_rng(seed)
         self.reset_world(nAgents, gridSize)
-
-        if seed is not None:
-            np.random.seed(seed)
+        self.stateIndex = self.buildStateIndex()
 
     def reset_world(self, numAgents, gridsize):
-        self.agents = []
-        self.landmarks = []
         self.steps = 0
+        self.invalidateCache()
 
-        for i in range(numAgents):
-            self.agents.append(np.random.randint(low=0,
-                                                 high=gridsize,
-                                                 size=2))
-        for i in range(numAgents):
-            self.landmarks.append(np.random.randint(low=0,
-                                                    high=gridsize,
-                                                    size=2))
-
-        self.agentReached = [False for i in range(numAgents)]
-
-    def getState(self, agentNum, addId=True):
-        """
-        State is the relative positions of all other Landmarks and agents
-        """
+        #  Agents followed by landmarks, both views into self.entities
+        self.entities = self.randomPositions(2 * numAgents, gridsize)
+        self.agents = self.entities[:numAgents]
+        self.landmarks = self.entities[numAgents:]
 
-        relPositions = []
-        for i in range(self.numAgents):
-            if(i != agentNum):
-                relPositions.append(self.agents[i] - self.agents[agentNum])
-            relPositions.append(self.landmarks[i] - self.agents[agentNum])
+        self.agentReached = np.zeros(numAgents, dtype=bool)
 
-        relPositions.append(self.agents[agentNum])
+    def resetArgs(self):
+        return (self.numAgents, self.gridSize)
 
-        if addId:
-            relPositions.append([agentNum])
+    def stateLayout(self):
+        agentIds = np.arange(self.numAgents)
+        sequence = np.stack([agentIds, agentIds + self.numAgents], axis=1)
+        owner = np.stack([agentIds, np.full_like(agentIds, -1)], axis=1)
 
-        return np.concatenate(relPositions)
+        return sequence.reshape(-1), owner.reshape(-1)
 
     def act(self, actions, viz=False):
         """
@@ -58,82 +46,51 @@ class GridEnv(MultiAgentGrid):
         Reward of all agets summed together
         """
 
-        if len(actions) != self.numAgents:
-            raise ValueError("Action size is incorrect")
+        # Update states of all agents
+        self.moveAgents(actions)
 
         self.steps += 1
-        reward = 0.0
 
-        # Update states of all agents
-        for ind, act in enumerate(actions):
-            if act == self.NOOP:
-                pass
-            elif act == self.LEFT:
-                self.agents[ind] = (self.agents[ind] + [0, -1] +
-                                    self.gridSize) % self.gridSize
-            elif act == self.RIGHT:
-                self.agents[ind] = (self.agents[ind] + [0, 1] +
-                                    self.gridSize) % self.gridSize
-            elif act == self.DOWN:
-                self.agents[ind] = (self.agents[ind] + [1, 0] +
-                                    self.gridSize) % self.gridSize
-            elif act == self.UP:
-                self.agents[ind] = (self.agents[ind] + [-1, 0] +
-                                    self.gridSize) % self.gridSize
-
-        #  Negative reward proportional to closest landmark
-        for i in range(self.numAgents):
-
-            dist1 = np.min(np.sum(
-                np.absolute(self.agents - self.landmarks[i]),
-                axis=1))
-
-            dist2 = np.min(
-                np.sum(np.absolute(
-                    np.absolute(self.agents - self.landmarks[i]) -
-                    [self.gridSize, self.gridSize]),
-                    axis=1))
-
-            dist3 = np.min(
-                np.sum(np.absolute(
-                    np.absolute(self.agents - self.landmarks[i]) -
-                    [self.gridSize, 0]),
-                    axis=1))
-
-            dist4 = np.min(
-                np.sum(np.absolute(
-                    np.absolute(self.agents - self.landmarks[i]) -
-                    [0, self.gridSize]),
-                    axis=1))
-
-            dist = min(dist1, dist2, dist3, dist4)
-            reward = reward - dist
-
-            #  Penalize collisions
-            for j in range(self.numAgents):
-                if j != i and (np.sum(self.agents[i] == self.agents[j]) == 2):
-                    reward -= self.gridSize
-
-            reward = reward/self.gridSize
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+
+        collisions = collisionCounts(self.agents, self.gridSize)
+
+        if profiler is not None:
+            start = profiler.lap("collisions", start)
+
+        #  Negative reward proportional to closest agent, and to collisions
+        nearest = nearestDistances(self.landmarks, self.agents, self.gridSize)
+        reward = coverageReward(nearest, collisions, self.gridSize)[()]
+
+        #  Kept for metrics, see episodeMetrics
+        self.lastCollisions = collisions
+        self.lastDistances = nearest
+
+        if profiler is not None:
+            profiler.lap("reward", start)
+
         if viz:
             self.visualizeState()
 
         return reward
 
-    def visualizeState(self):
-        if self.numAgents >= 6:
-            raise ValueError("Visualization works for only if No." +
-                             "of Agents < 6")
+    def sequenceRewards(self, trajectory, numPlans):
+        collisions = collisionCounts(trajectory, self.gridSize)
+        nearest = nearestDistances(np.expand_dims(self.landmarks, -3),
+                                   trajectory, self.gridSize)
+        rewards = coverageReward(nearest, collisions, self.gridSize)
+
+        return rewards, {"entities": self.finalEntities(trajectory)}
 
-        N = self.gridSize
-        # make an empty data set
-        data = np.ones((N, N)) * np.nan
+    def renderCells(self):
+        #  Agent i in color i + 1 then landmark i in color 0
+        positions = np.stack([self.agents, self.landmarks], axis=-2)
+        positions = positions.reshape(-1, 2)
 
-        for i in range(self.numAgents):
-            x1, y1 = self.agents[i]
-            x2, y2 = self.landmarks[i]
-            data[x1][y1] = i + 1
-            data[x2][y2] = 0
+        colorIds = np.zeros((self.numAgents, 2), dtype=int)
+        colorIds[:, 0] = np.arange(1, self.numAgents + 1)
 
         colors = [
             '#566573',
@@ -143,22 +100,4 @@ class GridEnv(MultiAgentGrid):
             '#1ABC9C',
             '#F4D03F']
 
-        colors = colors[0: self.numAgents + 1]
-
-        # make a figure + axes
-        fig, ax = plt.subplots(1, 1, tight_layout=True)
-        # make color map
-        my_cmap = matplotlib.colors.ListedColormap(colors)
-        # set the 'bad' values (nan) to be white and transparent
-        my_cmap.set_bad(color='w', alpha=0)
-        # draw the grid
-        for x in range(N + 1):
-            ax.axhline(x, lw=2, color='k', zorder=5)
-            ax.axvline(x, lw=2, color='k', zorder=5)
-        # draw the boxes
-        ax.imshow(data, interpolation='none', cmap=my_cmap,
-                  extent=[0, N, 0, N], zorder=0)
-        # turn off the axis labels
-        ax.axis('off')
-        plt.savefig("img_cover/" + str(self.steps) + ".png")
-        plt.close()
+        return positions, colorIds.reshape(-1), colors
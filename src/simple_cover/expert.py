@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from gridEnvironment import greedyActions, greedyAssignment, torusDistance
+
+
+def expertActions(agents, landmarks, gridSize):
+    """
+    Greedy simple_cover policy, every agent steps towards its own
+    landmark, nearest pairs assigned first. agents and landmarks have
+    shape (..., nAgents, 2), any leading dimensions are worlds, and the
+    actions (..., nAgents)
+    """
+
+    distances = torusDistance(agents[..., :, None, :],
+                              landmarks[..., None, :, :], gridSize)
+    targets = greedyAssignment(distances)
+    goals = np.take_along_axis(landmarks, targets[..., None], axis=-2)
+
+    return greedyActions(agents, goals, gridSize)
+
+
+def expertPolicy(env):
+    return expertActions(env.agents, env.landmarks, env.gridSize)
@@ -1,56 +1,78 @@
 #!/usr/bin/env python3
 
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
-from gridEnvironment import MultiAgentGrid
+from gridEnvironment import MultiAgentGrid, spawnSeeds, torusDistance
+
+
+def referenceReward(agents, landmarks, agentReached, sparse, gridSize):
+    """
+    Reward of simple_reference, batched over leading dimensions.
+    agentReached is updated in place when the reward is sparse
+    """
+
+    if sparse:
+        atLandmark = np.all(agents == landmarks, axis=-1)
+        firstVisit = atLandmark & ~agentReached
+        agentReached |= firstVisit
+
+        #  Accumulate +1 and +0.05 terms agent by agent, in the order of the
+        #  original loop, so that rewards match bit for bit
+        terms = np.stack([firstVisit * 1.0,
+                          (agentReached & atLandmark) * 0.05], axis=-1)
+        terms = terms.reshape(terms.shape[:-2] + (-1,))
+
+        return np.cumsum(terms, axis=-1)[..., -1]
+
+    dist = torusDistance(agents, landmarks, gridSize)
+
+    return -np.sum(dist, axis=-1) / gridSize
 
 
 class GridEnv(MultiAgentGrid):
 
-    def __init__(self, gridSize=7, nAgents=2, sparseReward=True, seed=None):
+    imageDir = "img_ref"
+
+    def __init__(self, gridSize=7, nAgents=2, sparseReward=True, seed=None,
+                 horizon=None):
         self.gridSize = gridSize
         self.numAgents = nAgents
         self.sparse = sparseReward
+        self.horizon = horizon
         self.defineMoves()
+        self.rng = np.random.default_rng(seed)
         self.reset_world(nAgents, gridSize)
-
-        if seed is not None:
-            np.random.seed(seed)
+        self.stateIndex = self.buildStateIndex()
 
     def reset_world(self, numAgents, gridsize):
-        self.agents = []
-        self.landmarks = []
         self.steps = 0
+        self.invalidateCache()
+
+        #  Agents followed by landmarks, both views into self.entities
+        self.entities = self.randomPositions(2 * numAgents, gridsize)
+        self.agents = self.entities[:numAgents]
+        self.landmarks = self.entities[numAgents:]
 
-        for i in range(numAgents):
-            self.agents.append(np.random.randint(low=0,
-                                                 high=gridsize,
-                                                 size=2))
-        for i in range(numAgents):
-            self.landmarks.append(np.random.randint(low=0,
-                                                    high=gridsize,
-                                                    size=2))
+        self.agentReached = np.zeros(numAgents, dtype=bool)
 
-        self.agentReached = [False for i in range(numAgents)]
+    def resetArgs(self):
+        return (self.numAgents, self.gridSize)
 
-    def getState(self, agentNum, addId=True):
+    def isDone(self):
         """
-        State is the relative positions of all other Landmarks and agents
+        With sparse reward, done once every agent reached its landmark
         """
 
-        relPositions = []
-        for i in range(self.numAgents):
-            if(i != agentNum):
-                relPositions.append(self.agents[i] - self.agents[agentNum])
-                relPositions.append(self.landmarks[i] - self.agents[agentNum])
+        if self.sparse:
+            return np.all(self.agentReached, axis=-1)
 
-        relPositions.append(self.agents[agentNum])
+        return super().isDone()
 
-        if addId:
-            relPositions.append([agentNum])
+    def stateLayout(self):
+        agentIds = np.arange(self.numAgents)
+        sequence = np.stack([agentIds, agentIds + self.numAgents], axis=1)
+        owner = np.stack([agentIds, agentIds], axis=1)
 
-        return np.concatenate(relPositions)
+        return sequence.reshape(-1), owner.reshape(-1)
 
     def act(self, actions, viz=False):
         """
@@ -59,70 +81,49 @@ class GridEnv(MultiAgentGrid):
         Reward of all agets summed together
         """
 
-        if len(actions) != self.numAgents:
-            raise ValueError("Action size is incorrect")
+        #  Update states of all agents
+        self.moveAgents(actions)
 
         self.steps += 1
-        reward = 0.0
 
-        #  Update states of all agents
-        for ind, act in enumerate(actions):
-            if act == self.NOOP:
-                pass
-            elif act == self.LEFT:
-                self.agents[ind] = (self.agents[ind] + [0, -1] +
-                                    self.gridSize) % self.gridSize
-            elif act == self.RIGHT:
-                self.agents[ind] = (self.agents[ind] + [0, 1] +
-                                    self.gridSize) % self.gridSize
-            elif act == self.DOWN:
-                self.agents[ind] = (self.agents[ind] + [1, 0] +
-                                    self.gridSize) % self.gridSize
-            elif act == self.UP:
-                self.agents[ind] = (self.agents[ind] + [-1, 0] +
-                                    self.gridSize) % self.gridSize
-
-        if self.sparse:
-            for i in range(self.numAgents):
-                #  Reach landmark
-                if not self.agentReached[i]:
-                    if np.sum(self.agents[i] == self.landmarks[i]) == 2:
-                        reward = reward + 1.0
-                        self.agentReached[i] = True
-                #  Once landmark Reached, stay there
-                if self.agentReached[i]:
-                    if np.sum(self.agents[i] == self.landmarks[i]) == 2:
-                        reward = reward + 0.05
-        else:
-            for i in range(self.numAgents):
-                x1, y1 = self.agents[i]
-                x2, y2 = self.landmarks[i]
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
 
-                xdist = min(abs(x1 - x2), self.gridSize - abs(x1 - x2))
-                ydist = min(abs(y1 - y2), self.gridSize - abs(y1 - y2))
-                reward = reward - xdist - ydist
+        reward = referenceReward(self.agents, self.landmarks,
+                                 self.agentReached, self.sparse,
+                                 self.gridSize)[()]
 
-            reward = reward / self.gridSize
+        if profiler is not None:
+            profiler.lap("reward", start)
 
         if viz:
             self.visualizeState()
 
         return reward
 
-    def visualizeState(self):
-        if self.numAgents >= 7:
-            raise ValueError("Visualization works for only if No." +
-                             "of Agents < 7")
+    def sequenceRewards(self, trajectory, numPlans):
+        landmarks = np.expand_dims(self.landmarks, -3)
 
-        N = self.gridSize
-        # make an empty data set
-        data = np.ones((N, N)) * np.nan
+        #  Flags before every step: the start flags, then every landmark
+        #  visit carried forward. referenceReward moves them one step on
+        reached = np.zeros(trajectory.shape[:-1], dtype=bool)
+        if self.sparse:
+            visited = np.logical_or.accumulate(
+                np.all(trajectory == landmarks, axis=-1), axis=-2)
+            reached[..., 1:, :] = visited[..., :-1, :]
+        reached |= np.expand_dims(self.agentReached, -2)
+
+        rewards = referenceReward(trajectory, landmarks, reached, self.sparse,
+                                  self.gridSize)
 
-        for i in range(self.numAgents):
-            x1, y1 = self.agents[i]
-            x2, y2 = self.landmarks[i]
-            data[x1][y1] = 2 * i
-            data[x2][y2] = 2 * i + 1
+        return rewards, {"entities": self.finalEntities(trajectory),
+                         "agentReached": reached[..., -1, :]}
+
+    def renderCells(self):
+        #  Agent i then landmark i, in colors 2i and 2i + 1
+        positions = np.stack([self.agents, self.landmarks], axis=-2)
+        positions = positions.reshape(self.agents.shape[:-2] + (-1, 2))
 
         colors = [
             '#EC7063',
@@ -138,22 +139,118 @@ class GridEnv(MultiAgentGrid):
             '#808B96',
             '#566573']
 
-        colors = colors[0: 2 * self.numAgents]
-
-        # make a figure + axes
-        fig, ax = plt.subplots(1, 1, tight_layout=True)
-        # make color map
-        my_cmap = matplotlib.colors.ListedColormap(colors)
-        # set the 'bad' values (nan) to be white and transparent
-        my_cmap.set_bad(color='w', alpha=0)
-        # draw the grid
-        for x in range(N + 1):
-            ax.axhline(x, lw=2, color='k', zorder=5)
-            ax.axvline(x, lw=2, color='k', zorder=5)
-        # draw the boxes
-        ax.imshow(data, interpolation='none', cmap=my_cmap,
-                  extent=[0, N, 0, N], zorder=0)
-        # turn off the axis labels
-        ax.axis('off')
-        plt.savefig("img_ref/" + str(self.steps) + ".png")
-        plt.close()
+        return positions, np.arange(2 * self.numAgents), colors
+
+
+class VecGridEnv(GridEnv):
+    """
+    numEnvs independent copies of GridEnv stepped together. Worlds are held
+    as (numEnvs, nAgents, 2) arrays and world b draws from its own
+    Generator, seeded with spawnSeeds(seed, numEnvs)[b], so it follows the
+    same trajectory as GridEnv(seed=spawnSeeds(seed, numEnvs)[b])
+    """
+
+    def __init__(self, numEnvs=8, gridSize=7, nAgents=2, sparseReward=True,
+                 seed=None, horizon=None):
+        self.numEnvs = numEnvs
+        self.gridSize = gridSize
+        self.numAgents = nAgents
+        self.sparse = sparseReward
+        self.horizon = horizon
+        self.finalStates = None
+        self.finalReached = None
+        self.defineMoves()
+        self.rngs = [np.random.default_rng(child)
+                     for child in spawnSeeds(seed, numEnvs)]
+
+        self.reset_world(nAgents, gridSize)
+        self.stateIndex = self.buildStateIndex()
+
+    def reset_world(self, numAgents, gridsize):
+        self.steps = np.zeros(self.numEnvs, dtype=int)
+        self.invalidateCache()
+
+        #  One draw per world of agents followed by landmarks, same as
+        #  GridEnv.reset_world
+        self.entities = np.stack([
+            self.randomPositions(2 * numAgents, gridsize, rng)
+            for rng in self.rngs])
+        self.agents = self.entities[:, :numAgents]
+        self.landmarks = self.entities[:, numAgents:]
+
+        self.agentReached = np.zeros((self.numEnvs, numAgents), dtype=bool)
+
+    def resetWorlds(self, worlds):
+        """
+        Starts a new episode in each of worlds, in place, each drawing from
+        its own Generator like reset_world, or from the resetBank when one
+        is set
+        """
+
+        if self.resetBank is not None:
+            self.resetBank.restore(self, worlds)
+            return
+
+        for b in worlds:
+            self.entities[b] = self.randomPositions(2 * self.numAgents,
+                                                    rng=self.rngs[b])
+        self.agentReached[worlds] = False
+        self.steps[worlds] = 0
+
+        if self.movedEntities is not None:
+            self.movedEntities[worlds] = True
+
+    def step(self, actions, out=None):
+        """
+        GridEnv.step for every world, with (numEnvs,) rewards and flags.
+        Worlds that finish are reset in place before the states are read,
+        their last states and agentReached flags are kept in finalStates
+        and finalReached (None when no world finished)
+        """
+
+        reward = self.act(actions)
+        done, truncated = self.episodeFlags()
+        self.finishEpisodes(done, truncated)
+
+        return self.getAllStates(out=out), reward, done, truncated
+
+    def finishEpisodes(self, done, truncated):
+        """
+        The end of step: resets the worlds that are done or truncated and
+        returns how many there were
+        """
+
+        finished = np.nonzero(done | truncated)[0]
+        if len(finished):
+            self.finalStates = self.getAllStates()
+            self.finalReached = self.agentReached.copy()
+            self.resetWorlds(finished)
+        else:
+            self.finalStates = None
+            self.finalReached = None
+
+        return len(finished)
+
+    def act(self, actions):
+        """
+        Returns Reward of every world, shape (numEnvs,)
+        actions has shape (numEnvs, nAgents)
+        """
+
+        #  Update states of all agents
+        self.moveAgents(actions)
+
+        self.steps += 1
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+
+        reward = referenceReward(self.agents, self.landmarks,
+                                 self.agentReached, self.sparse,
+                                 self.gridSize)
+
+        if profiler is not None:
+            profiler.lap("reward", start)
+
+        return reward
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+
+from gridEnvironment import greedyActions
+
+
+def expertActions(agents, landmarks, gridSize):
+    """
+    Greedy simple_reference policy, every agent steps towards the landmark
+    with its index. agents and landmarks have shape (..., nAgents, 2), any
+    leading dimensions are worlds, and the actions (..., nAgents)
+    """
+
+    return greedyActions(agents, landmarks, gridSize)
+
+
+def expertPolicy(env):
+    """
+    Expert actions for the current state of a GridEnv or VecGridEnv
+    """
+
+    return expertActions(env.agents, env.landmarks, env.gridSize)
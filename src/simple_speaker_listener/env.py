@@ -1,53 +1,105 @@
 #!/usr/bin/env python3
 
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
-from gridEnvironment import MultiAgentGrid
+from gridEnvironment import MultiAgentGrid, torusDistance
 
 
 class GridEnv(MultiAgentGrid):
 
-    def __init__(self, gridSize=7, landMarks=3, seed=None):
+    imageDir = "img_speak"
+    snapshotScalars = ("steps", "target")
+    snapshotArrays = ("entities",)
+
+    def __init__(self, gridSize=7, landMarks=3, seed=None, horizon=None):
         self.gridSize = gridSize
         self.landMarksNum = landMarks
+        self.horizon = horizon
         self.defineMoves()
-        if seed is not None:
-            np.random.seed(seed)
+        self.rng = np.random.default_rng(seed)
 
         self.reset_world()
 
+    @property
+    def agent(self):
+        return self.agents[0]
+
     def reset_world(self):
-        self.landmarks = []
         self.steps = 0
 
-        self.agent = np.random.randint(low=0,
-                                       high=self.gridSize,
-                                       size=2)
+        #  Only the listener moves, it is the single row of self.agents
+        agent = self.randomPositions(1)
+
+        self.target = int(self.rng.integers(low=0,
+                                            high=self.landMarksNum))
+
+        landmarks = self.randomPositions(self.landMarksNum)
 
-        self.target = np.random.randint(low=0,
-                                        high=self.landMarksNum)
+        #  Agent followed by landmarks, both views into self.entities
+        self.entities = np.concatenate([agent, landmarks])
+        self.agents = self.entities[:1]
+        self.landmarks = self.entities[1:]
 
-        for i in range(self.landMarksNum):
-            self.landmarks.append(np.random.randint(low=0,
-                                                    high=self.gridSize,
-                                                    size=2))
+    def startSnapshots(self, entities, rng):
+        rows = super().startSnapshots(entities, rng)
+        rows[:, self.snapshotScalars.index("target")] = rng.integers(
+            low=0, high=self.landMarksNum, size=len(entities))
+
+        return rows
 
     def getState(self, agentNum, addId=True):
         """
         State is the relative positions of all other Landmarks and agents
         """
 
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+
         if agentNum == 0:
             relPositions = []
             for i in range(self.landMarksNum):
                 if(i != agentNum):
                     relPositions.append(self.landmarks[i] - self.agent)
             relPositions.append(self.agent)
-            return np.concatenate(relPositions)
+            state = np.concatenate(relPositions, dtype=np.int_)
 
         else:
-            return np.asarray([self.target])
+            state = np.asarray([self.target])
+
+        if profiler is not None:
+            profiler.lap("getState", start)
+
+        return state
+
+    def stateShape(self, addId=True):
+        return (2, 2 * self.landMarksNum)
+
+    def getAllStates(self, addId=True, out=None):
+        """
+        getState(0) and getState(1) as the rows of one (2, obsDim) matrix,
+        the single target entry of row 1 is padded with zeros
+        """
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+
+        if out is None:
+            out = np.empty(self.stateShape(addId), dtype=np.int_)
+        elif out.shape != self.stateShape(addId):
+            raise ValueError("State buffer has the wrong shape")
+
+        numCols = 2 * (self.landMarksNum - 1)
+        out[0, :numCols] = (self.landmarks[1:] - self.agent).reshape(-1)
+        out[0, numCols:] = self.agent
+
+        out[1, 0] = self.target
+        out[1, 1:] = 0
+
+        if profiler is not None:
+            profiler.lap("getAllStates", start)
+
+        return out
 
     def act(self, action, viz=False):
         """
@@ -56,54 +108,54 @@ class GridEnv(MultiAgentGrid):
         Reward of all agets summed together
         """
 
+        #  Update states of all agents
+        self.moveAgents(np.reshape(action, 1))
+
         self.steps += 1
         reward = 0.0
 
-        #  Update states of all agents
-        if action == self.NOOP:
-            pass
-        elif action == self.LEFT:
-            self.agent = (self.agent + [0, -1] +
-                          self.gridSize) % self.gridSize
-        elif action == self.RIGHT:
-            self.agent = (self.agent + [0, 1] +
-                          self.gridSize) % self.gridSize
-        elif action == self.DOWN:
-            self.agent = (self.agent + [1, 0] +
-                          self.gridSize) % self.gridSize
-        elif action == self.UP:
-            self.agent = (self.agent + [-1, 0] +
-                          self.gridSize) % self.gridSize
         if viz:
             self.visualizeState()
 
-        x1, y1 = self.agent
-        x2, y2 = self.landmarks[self.target]
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
 
-        xdist = min(abs(x1 - x2), self.gridSize - abs(x1 - x2))
-        ydist = min(abs(y1 - y2), self.gridSize - abs(y1 - y2))
-        reward = reward - xdist - ydist
+        reward = reward - torusDistance(self.agent,
+                                        self.landmarks[self.target],
+                                        self.gridSize)
 
         reward = reward / self.gridSize
 
+        if profiler is not None:
+            profiler.lap("reward", start)
+
         return reward
 
-    def visualizeState(self):
-        if self.landMarksNum >= 7:
-            raise ValueError("Visualization works for only if No." +
-                             "of Agents < 7")
+    def act_sequence(self, actions):
+        """
+        act over a plan of shape (T,), or (P, T) for P plans, see
+        MultiAgentGrid.act_sequence
+        """
+
+        return super().act_sequence(np.asarray(actions)[..., None])
 
-        N = self.gridSize
-        # make an empty data set
-        data = np.ones((N, N)) * np.nan
+    def sequenceRewards(self, trajectory, numPlans):
+        goal = self.landmarks[self.target]
+        rewards = -torusDistance(trajectory[..., 0, :], goal,
+                                 self.gridSize) / self.gridSize
 
-        x1, y1 = self.agent
+        return rewards, {"entities": self.finalEntities(trajectory)}
 
-        for i in range(self.landMarksNum):
-            x2, y2 = self.landmarks[i]
-            data[x2][y2] = i
-            if i == self.target:
-                data[x1][y1] = i
+    def renderCells(self):
+        #  Landmark i in color i, the agent in the color of its target,
+        #  painted right after the target landmark
+        positions = np.concatenate([self.landmarks, self.agents])
+        positions = positions[np.insert(np.arange(self.landMarksNum),
+                                        self.target + 1,
+                                        self.landMarksNum)]
+        colorIds = np.insert(np.arange(self.landMarksNum), self.target + 1,
+                             self.target)
 
         colors = [
             '#E74C3C',
@@ -113,22 +165,4 @@ class GridEnv(MultiAgentGrid):
             '#F1C40F',
             '#566573']
 
-        colors = colors[0: self.landMarksNum]
-
-        # make a figure + axes
-        fig, ax = plt.subplots(1, 1, tight_layout=True)
-        # make color map
-        my_cmap = matplotlib.colors.ListedColormap(colors)
-        # set the 'bad' values (nan) to be white and transparent
-        my_cmap.set_bad(color='w', alpha=0)
-        # draw the grid
-        for x in range(N + 1):
-            ax.axhline(x, lw=2, color='k', zorder=5)
-            ax.axvline(x, lw=2, color='k', zorder=5)
-        # draw the boxes
-        ax.imshow(data, interpolation='none', cmap=my_cmap,
-                  extent=[0, N, 0, N], zorder=0)
-        # turn off the axis labels
-        ax.axis('off')
-        plt.savefig("img_speak/" + str(self.steps) + ".png")
-        plt.close()
+        return positions, colorIds, colors
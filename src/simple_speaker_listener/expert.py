@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from gridEnvironment import greedyActions
+
+
+def expertActions(agents, landmarks, target, gridSize):
+    """
+    Greedy simple_speaker_listener policy, the listener steps towards the
+    target landmark. agents has shape (..., 1, 2), landmarks
+    (..., landMarks, 2) and target (...), any leading dimensions are
+    worlds, as are the actions
+    """
+
+    target = np.asarray(target)[..., None, None]
+    goals = np.take_along_axis(landmarks, target, axis=-2)
+
+    return greedyActions(agents, goals, gridSize)[..., 0]
+
+
+def expertPolicy(env):
+    return expertActions(env.agents, env.landmarks, env.target, env.gridSize)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import multiprocessing as mp
+import traceback
+import numpy as np
+from gridEnvironment import spawnSeeds
+from registry import checkSingle, envClass as lookupEnvClass
+
+
+def sharedArray(ctx, shape, dtype):
+    """
+    Zero filled NumPy array backed by shared memory, returned with the raw
+    block so it can be handed to worker processes
+    """
+
+    dtype = np.dtype(dtype)
+    raw = ctx.RawArray('b', max(1, int(np.prod(shape)) * dtype.itemsize))
+
+    return raw, viewArray(raw, shape, dtype)
+
+
+def viewArray(raw, shape, dtype):
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+
+    return np.frombuffer(raw, dtype=dtype, count=count).reshape(shape)
+
+
+def worker(conn, envClass, envKwargs, first, seeds, buffers):
+    """
+    Hosts envs first..first+len(seeds)-1, one per seed, and steps them on
+    command, exchanging actions, states, rewards and episode flags through
+    the shared buffers. Envs whose episode ends are reset in place
+    """
+
+    try:
+        #  Registered names are resolved here, so a spawned worker imports
+        #  only its own domain
+        if isinstance(envClass, str):
+            envClass = lookupEnvClass(envClass)
+        envs = [envClass(seed=seed, **envKwargs) for seed in seeds]
+
+        actions, states, rewards, dones, truncated = \
+            [viewArray(*buf) for buf in buffers]
+
+        for i, env in enumerate(envs, first):
+            env.getAllStates(out=states[i])
+    except Exception:
+        conn.send(traceback.format_exc())
+        conn.close()
+        return
+    conn.send(None)
+
+    while True:
+        try:
+            cmd = conn.recv()
+        except EOFError:
+            break
+
+        if cmd == "close":
+            conn.send(None)
+            break
+
+        try:
+            if cmd == "step":
+                for i, env in enumerate(envs, first):
+                    _, rewards[i], dones[i], truncated[i] = env.step(
+                        actions[i], out=states[i])
+                    if dones[i] or truncated[i]:
+                        env.reset(out=states[i])
+            elif cmd == "reset":
+                for i, env in enumerate(envs, first):
+                    env.reset(out=states[i])
+            else:
+                raise ValueError("Unknown command " + str(cmd))
+        except Exception:
+            conn.send(traceback.format_exc())
+        else:
+            conn.send(None)
+
+    conn.close()
+
+
+class SubprocVecEnv(object):
+    """
+    numEnvs copies of envClass, a class or a registered domain name,
+    spread over numWorkers processes. Actions, states, rewards and episode
+    flags live in shared memory, pipes only carry commands. Envs whose
+    episode ends are reset in place
+    """
+
+    def __init__(self, envClass, numEnvs=8, numWorkers=None, seed=None,
+                 context=None, **envKwargs):
+        self.numEnvs = numEnvs
+        self.numWorkers = min(numEnvs, numWorkers or mp.cpu_count())
+        self.waiting = False
+        self.closed = False
+
+        #  Shapes are read off a local instance
+        if isinstance(envClass, str):
+            checkSingle(envClass)
+            probe = lookupEnvClass(envClass)(**envKwargs)
+        else:
+            probe = envClass(**envKwargs)
+        if probe.agents.ndim != 2:
+            raise ValueError("SubprocVecEnv steps single world envs, not " +
+                             type(probe).__name__)
+        self.actionShape = probe.agents.shape[:-1]
+        self.stateShape = probe.stateShape()
+
+        ctx = mp.get_context(context)
+        actionBuf, self.actions = sharedArray(
+            ctx, (numEnvs,) + self.actionShape, np.int_)
+        stateBuf, self.states = sharedArray(
+            ctx, (numEnvs,) + self.stateShape, np.int_)
+        rewardBuf, self.rewards = sharedArray(ctx, (numEnvs,), np.float64)
+        doneBuf, self.dones = sharedArray(ctx, (numEnvs,), np.bool_)
+        truncatedBuf, self.truncated = sharedArray(ctx, (numEnvs,), np.bool_)
+        buffers = [(actionBuf, self.actions.shape, np.int_),
+                   (stateBuf, self.states.shape, np.int_),
+                   (rewardBuf, self.rewards.shape, np.float64),
+                   (doneBuf, self.dones.shape, np.bool_),
+                   (truncatedBuf, self.truncated.shape, np.bool_)]
+
+        #  Independent, reproducible RNG stream for every env
+        seeds = spawnSeeds(seed, numEnvs)
+        bounds = np.linspace(0, numEnvs, self.numWorkers + 1).astype(int)
+
+        self.conns = []
+        self.processes = []
+        for w in range(self.numWorkers):
+            parentConn, childConn = ctx.Pipe()
+            process = ctx.Process(target=worker,
+                                  args=(childConn, envClass, envKwargs,
+                                        bounds[w],
+                                        seeds[bounds[w]:bounds[w + 1]],
+                                        buffers),
+                                  daemon=True)
+            process.start()
+            childConn.close()
+            self.conns.append(parentConn)
+            self.processes.append(process)
+
+        self.waitAll()
+
+    def waitAll(self):
+        errors = []
+        for conn in self.conns:
+            try:
+                errors.append(conn.recv())
+            except (EOFError, OSError):
+                errors.append("Worker exited without replying\n")
+        errors = [err for err in errors if err is not None]
+        if errors:
+            self.close()
+            raise RuntimeError("Worker failed\n" + errors[0])
+
+    def getAllStates(self):
+        """
+        States of all envs, shape (numEnvs, *env.stateShape())
+        """
+
+        return self.states.copy()
+
+    def reset(self):
+        """
+        Starts a new episode in every env and returns their states
+        """
+
+        if self.waiting:
+            raise RuntimeError("reset called between step_async and "
+                               "step_wait")
+
+        for conn in self.conns:
+            conn.send("reset")
+        self.waitAll()
+
+        return self.states.copy()
+
+    def step_async(self, actions):
+        """
+        Starts stepping every env with actions, shape (numEnvs, nAgents)
+        """
+
+        if self.waiting:
+            raise RuntimeError("step_async called twice without step_wait")
+
+        self.actions[...] = np.reshape(actions, self.actions.shape)
+        for conn in self.conns:
+            conn.send("step")
+        self.waiting = True
+
+    def step_wait(self):
+        """
+        Returns states, rewards, dones and truncated flags of the step
+        started by step_async. States of envs that finished are already
+        those of their next episode
+        """
+
+        if not self.waiting:
+            raise RuntimeError("step_wait called without step_async")
+
+        self.waiting = False
+        self.waitAll()
+
+        return (self.states.copy(), self.rewards.copy(), self.dones.copy(),
+                self.truncated.copy())
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        for conn in self.conns:
+            try:
+                if self.waiting:
+                    conn.recv()
+                conn.send("close")
+                conn.recv()
+            except (EOFError, OSError, BrokenPipeError):
+                pass
+            conn.close()
+
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
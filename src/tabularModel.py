@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import numpy as np
+
+from gridEnvironment import (cellIndex, collisionCounts, coverageReward,
+                             nearestDistances, torusDistance)
+from simple_reference.env import GridEnv as ReferenceEnv, referenceReward
+from simple_cover.env import GridEnv as CoverEnv
+from simple_chaser.env import GridEnv as ChaserEnv
+from simple_speaker_listener.env import GridEnv as SpeakerListenerEnv
+
+
+def jointActions(numAgents):
+    """
+    Row a holds the action of every agent in joint action a, the action of
+    agent i is base 5 digit i of a
+    """
+
+    a = np.arange(5 ** numAgents)
+
+    return (a[:, None] // 5 ** np.arange(numAgents)) % 5
+
+
+def cellPositions(cells, gridSize):
+    return np.stack([cells // gridSize, cells % gridSize], axis=-1)
+
+
+def agentCells(states, numAgents, gridSize):
+    """
+    Cell of every agent, agent i is base gridSize ** 2 digit i of states
+    """
+
+    numCells = gridSize * gridSize
+
+    return (states[..., None] // numCells ** np.arange(numAgents)) % numCells
+
+
+def encodeCells(cells, gridSize):
+    numCells = gridSize * gridSize
+
+    return np.sum(cells * numCells ** np.arange(cells.shape[-1]), axis=-1)
+
+
+class ModelBuilder(object):
+    """
+    Enumerates the joint states of one env instance, with its landmarks
+    held fixed. States are integers in [0, numStates), joint actions index
+    the rows of jointActions(numAgents)
+    """
+
+    def __init__(self, env):
+        if isinstance(env, ChaserEnv):
+            raise ValueError("simple_chaser prey move at random, it has no "
+                             "deterministic model")
+        if not isinstance(env, (ReferenceEnv, CoverEnv,
+                                SpeakerListenerEnv)):
+            raise ValueError("No tabular model for " + type(env).__name__)
+        if env.agents.ndim != 2:
+            raise ValueError("Tabular models need a single world env")
+
+        self.env = env
+        self.gridSize = env.gridSize
+        self.numCells = env.gridSize * env.gridSize
+        self.numAgents = env.agents.shape[0]
+        self.actions = jointActions(self.numAgents)
+        self.moves = env.moveDeltas[self.actions]
+
+        if isinstance(env, SpeakerListenerEnv):
+            self.domain = "simple_speaker_listener"
+            self.count = env.landMarksNum
+            #  Agent cell, then target
+            self.numStates = self.numCells * env.landMarksNum
+        elif isinstance(env, ReferenceEnv):
+            self.domain = "simple_reference_" + \
+                ("sparse" if env.sparse else "dense")
+            self.count = self.numAgents
+            #  Agent cells, then agentReached bits when they affect reward
+            self.numStates = self.numCells ** self.numAgents
+            if env.sparse:
+                self.numStates *= 2 ** self.numAgents
+        else:
+            self.domain = "simple_cover"
+            self.count = self.numAgents
+            self.numStates = self.numCells ** self.numAgents
+
+        self.numActions = len(self.actions)
+
+    def cacheKey(self):
+        """
+        File name of the model, the landmark positions enter as a hash
+        """
+
+        digest = hashlib.sha1(
+            self.env.landmarks.astype(np.int64).tobytes()).hexdigest()
+
+        return "%s_G%d_n%d_%s.npz" % (self.domain, self.gridSize, self.count,
+                                      digest[:12])
+
+    def stateOf(self):
+        """
+        Index of the current state of the env
+        """
+
+        env = self.env
+        cells = cellIndex(env.agents, self.gridSize)
+
+        if self.domain == "simple_speaker_listener":
+            return int(env.target * self.numCells + cells[0])
+
+        state = int(encodeCells(cells, self.gridSize))
+        if self.domain == "simple_reference_sparse":
+            bits = np.sum(env.agentReached << np.arange(self.numAgents))
+            state += int(bits) * self.numCells ** self.numAgents
+
+        return state
+
+    def step(self, states):
+        """
+        Next states and rewards of states under every joint action, both of
+        shape (len(states), numActions)
+        """
+
+        env = self.env
+        G = self.gridSize
+
+        if self.domain == "simple_speaker_listener":
+            target = states // self.numCells
+            agent = cellPositions(states % self.numCells, G)
+            agent = (agent[:, None] + self.moves[:, 0]) % G
+
+            goal = env.landmarks[target][:, None]
+            reward = -torusDistance(agent, goal, G) / G
+            nextStates = target[:, None] * self.numCells + \
+                cellIndex(agent, G)
+
+            return nextStates, reward
+
+        numPositions = self.numCells ** self.numAgents
+        agents = cellPositions(
+            agentCells(states % numPositions, self.numAgents, G), G)
+        agents = (agents[:, None] + self.moves) % G
+
+        if self.domain == "simple_cover":
+            collisions = collisionCounts(agents, G)
+            nearest = nearestDistances(env.landmarks, agents, G)
+            reward = coverageReward(nearest, collisions, G)
+            nextStates = encodeCells(cellIndex(agents, G), G)
+
+            return nextStates, reward
+
+        bits = (states // numPositions)[:, None] >> np.arange(self.numAgents)
+        reached = np.repeat((bits & 1).astype(bool)[:, None],
+                            self.numActions, axis=1)
+
+        reward = referenceReward(agents, env.landmarks, reached, env.sparse,
+                                 G)
+        nextStates = encodeCells(cellIndex(agents, G), G)
+        if env.sparse:
+            bits = np.sum(reached << np.arange(self.numAgents), axis=-1)
+            nextStates += bits * numPositions
+
+        return nextStates, reward
+
+    def build(self, chunkSize=2 ** 14, maxEntries=2 ** 27):
+        """
+        Enumerates every state, chunkSize state-action pairs at a time
+        """
+
+        numEntries = self.numStates * self.numActions
+        if numEntries > maxEntries:
+            raise ValueError("Model has %d state-action pairs, more than "
+                             "maxEntries" % numEntries)
+
+        if self.numStates < np.iinfo(np.int32).max:
+            stateDtype = np.int32
+        else:
+            stateDtype = np.int64
+
+        nextState = np.empty((self.numStates, self.numActions),
+                             dtype=stateDtype)
+        reward = np.empty((self.numStates, self.numActions))
+
+        statesPerChunk = max(1, chunkSize // self.numActions)
+        for first in range(0, self.numStates, statesPerChunk):
+            states = np.arange(first,
+                               min(first + statesPerChunk, self.numStates))
+            nextState[states], reward[states] = self.step(states)
+
+        return TabularModel(nextState, reward, self.domain)
+
+
+class TabularModel(object):
+    """
+    Deterministic model of a small env: nextState[s, a] and reward[s, a]
+    for every state s and joint action a. nextState is the compact form of
+    the 0/1 transition matrices, one nonzero per row
+    """
+
+    def __init__(self, nextState, reward, domain):
+        self.nextState = nextState
+        self.reward = reward
+        self.domain = domain
+
+    @property
+    def numStates(self):
+        return self.nextState.shape[0]
+
+    @property
+    def numActions(self):
+        return self.nextState.shape[1]
+
+    def transitionCSR(self, action):
+        """
+        (data, indices, indptr) of the (numStates, numStates) CSR transition
+        matrix of joint action action, row s holds a single 1 at
+        nextState[s, action]
+        """
+
+        data = np.ones(self.numStates)
+        indices = self.nextState[:, action].copy()
+        indptr = np.arange(self.numStates + 1, dtype=indices.dtype)
+
+        return data, indices, indptr
+
+    def transitionMatrix(self, action):
+        """
+        transitionCSR as a scipy.sparse matrix. scipy is optional and only
+        needed here
+        """
+
+        from scipy.sparse import csr_matrix
+
+        return csr_matrix(self.transitionCSR(action),
+                          shape=(self.numStates, self.numStates))
+
+    def valueIteration(self, gamma=0.95, tol=1e-8, maxIter=10000):
+        """
+        Optimal values and greedy joint actions of every state
+        """
+
+        values = np.zeros(self.numStates)
+        for i in range(maxIter):
+            q = self.reward + gamma * values[self.nextState]
+            newValues = q.max(axis=1)
+            delta = np.max(np.abs(newValues - values), initial=0.0)
+            values = newValues
+            if delta < tol:
+                break
+
+        return values, q.argmax(axis=1)
+
+    def save(self, path):
+        np.savez(path, nextState=self.nextState, reward=self.reward,
+                 domain=self.domain)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["nextState"], data["reward"],
+                       str(data["domain"]))
+
+
+def exportModel(env, cacheDir=None, chunkSize=2 ** 14, maxEntries=2 ** 27):
+    """
+    Tabular model of env with its current landmarks. With cacheDir the
+    model is loaded from, or saved to, a file keyed by domain, gridSize,
+    agent or landmark count and landmark positions
+    """
+
+    builder = ModelBuilder(env)
+
+    path = None
+    if cacheDir is not None:
+        path = os.path.join(cacheDir, builder.cacheKey())
+        if os.path.exists(path):
+            return TabularModel.load(path)
+
+    model = builder.build(chunkSize, maxEntries)
+
+    if path is not None:
+        os.makedirs(cacheDir, exist_ok=True)
+        model.save(path)
+
+    return model
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import json
+import operator
+import os
+import numpy as np
+
+
+class TrajectoryRecorder(object):
+    """
+    Wraps a GridEnv (or a batched variant) and records one row per act:
+    episode, step, all entity positions, actions, reward and, when the env
+    has them, the target and agentReached flags. Each reset starts a new
+    episode whose first row holds the start state, with actions of -1.
+    Episode ids are counted per world. meta.json is rewritten with every
+    chunk, so the rows written so far stay readable if the process dies.
+    Column files already in directory are overwritten. Other attributes
+    are passed through to the env
+    """
+
+    #  Columns are gathered into contiguous blocks of this many bytes
+    #  before writing
+    blockBytes = 1 << 20
+
+    def __init__(self, env, directory, chunkSize=4096):
+        self.env = env
+        self.directory = directory
+
+        os.makedirs(directory, exist_ok=True)
+
+        actionShape = env.agents.shape[:-1]
+        batchShape = env.agents.shape[:-2]
+        self.episode = np.zeros(batchShape, dtype=np.int32)
+        columns = [
+            ("episode", np.int32, batchShape),
+            ("actions", np.int8, actionShape),
+            ("reward", np.float64, batchShape),
+            ("step", np.int32, np.shape(env.steps)),
+            ("entities", env.entities.dtype, env.entities.shape)]
+        #  Env attributes of the columns after reward
+        attributes = ["steps", "entities"]
+        if hasattr(env, "target"):
+            columns.append(("target", np.int16, np.shape(env.target)))
+            attributes.append("target")
+        if hasattr(env, "agentReached"):
+            columns.append(("agentReached", np.bool_, env.agentReached.shape))
+            attributes.append("agentReached")
+        self.envValues = operator.attrgetter(*attributes)
+
+        #  Rows are buffered whole, each column goes to its own file
+        self.buffer = np.empty(chunkSize, dtype=columns)
+        self.pending = 0
+        self.length = 0
+        blockRows = max(1, self.blockBytes // self.buffer.itemsize)
+        self.blocks = {name: np.empty_like(self.buffer[name][:blockRows])
+                       for name in self.buffer.dtype.names}
+        self.files = {name: open(os.path.join(directory, name + ".bin"), "wb")
+                      for name in self.buffer.dtype.names}
+
+        self.record(-1, 0.0)
+
+    def __getattr__(self, name):
+        if name == "env":
+            raise AttributeError(name)
+        return getattr(self.env, name)
+
+    def record(self, actions, reward):
+        pending = self.pending
+        self.buffer[pending] = ((self.episode, actions, reward) +
+                                self.envValues(self.env))
+        self.pending = pending + 1
+        if self.pending == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        """
+        Writes buffered rows, then the column metadata
+        """
+
+        if self.pending:
+            for name, f in self.files.items():
+                column = self.buffer[name]
+                block = self.blocks[name]
+                for start in range(0, self.pending, len(block)):
+                    rows = block[:min(len(block), self.pending - start)]
+                    np.copyto(rows, column[start:start + len(rows)])
+                    f.write(rows.data)
+                f.flush()
+            self.length += self.pending
+            self.pending = 0
+
+        meta = {}
+        for name in self.buffer.dtype.names:
+            dtype = self.buffer.dtype[name]
+            meta[name] = {"shape": list(dtype.shape), "dtype": dtype.base.str,
+                          "length": self.length}
+
+        #  Replaced in one step, readers never see a partial file
+        path = os.path.join(self.directory, "meta.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    def act(self, actions, *args, **kwargs):
+        reward = self.env.act(actions, *args, **kwargs)
+        self.record(actions, reward)
+
+        return reward
+
+    def reset_world(self, *args):
+        self.env.reset_world(*args)
+        self.episode += 1
+        self.record(-1, 0.0)
+
+    def reset(self, out=None):
+        states = self.env.reset(out=out)
+        self.episode += 1
+        self.record(-1, 0.0)
+
+        return states
+
+    def step(self, actions, out=None):
+        """
+        env.step, recording the row of the act. Batched envs that reset
+        worlds within step start a new episode in those worlds, with a row
+        holding the states after the reset. Other worlds repeat their
+        state in that row
+        """
+
+        env = self.env
+
+        reward = self.act(actions)
+        done, truncated = env.episodeFlags()
+        if hasattr(env, "finishEpisodes") and \
+                env.finishEpisodes(done, truncated):
+            self.episode[np.logical_or(done, truncated)] += 1
+            self.record(-1, 0.0)
+
+        return env.getAllStates(out=out), reward, done, truncated
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+
+class TrajectoryReader(object):
+    """
+    Memory-mapped view of the columns written by TrajectoryRecorder.
+    Recordings of batched envs are read one world at a time
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+
+        self.columns = {}
+        for name, info in meta.items():
+            shape = (info["length"],) + tuple(info["shape"])
+            if info["length"] == 0:
+                self.columns[name] = np.empty(shape, dtype=info["dtype"])
+            else:
+                self.columns[name] = np.memmap(
+                    os.path.join(directory, name + ".bin"),
+                    dtype=info["dtype"], mode="r", shape=shape)
+
+        self.numRows = len(self.columns["step"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def episodes(self, world=None):
+        return np.unique(self.worldColumn("episode", world))
+
+    def worldColumn(self, name, world=None):
+        column = self.columns[name]
+        if column.ndim == 1:
+            return column
+        if world is None:
+            raise ValueError("Recording of a batched env, pass a world")
+
+        return column[:, world]
+
+    def episode(self, episode, world=None):
+        """
+        Rows of one episode, of world for a batched env, as a dict of
+        columns
+        """
+
+        bounds = np.searchsorted(self.worldColumn("episode", world),
+                                 [episode, episode + 1])
+        if self.columns["episode"].ndim == 1:
+            rows = slice(bounds[0], bounds[1])
+            return {name: column[rows]
+                    for name, column in self.columns.items()}
+
+        #  Drop the rows where only other worlds started an episode
+        rows = np.arange(bounds[0], bounds[1])
+        actions = self.columns["actions"][rows, world].reshape(len(rows), -1)
+        keep = np.any(actions != -1, axis=-1)
+        keep[:1] = True
+        rows = rows[keep]
+
+        return {name: column[rows, world]
+                for name, column in self.columns.items()}
+
+    def replay(self, env, episode, world=None):
+        """
+        Restores env in place to every recorded state of episode in turn,
+        yielding the env after each restore. Worlds of a batched recording
+        are restored into a single world env
+        """
+
+        rows = self.episode(episode, world)
+        for i in range(len(rows["step"])):
+            env.entities[...] = rows["entities"][i]
+            if np.ndim(env.steps):
+                env.steps[...] = rows["step"][i]
+            else:
+                env.steps = int(rows["step"][i])
+            if "target" in rows:
+                env.target = int(rows["target"][i])
+            if "agentReached" in rows:
+                env.agentReached[...] = rows["agentReached"][i]
+            env.invalidateCache()
+            yield env
+
+    def frames(self, env, episode, world=None):
+        """
+        Rendered frames of episode, shape (T, H, W, 3)
+        """
+
+        return np.stack([e.render().copy()
+                         for e in self.replay(env, episode, world)])
@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+#  Modules live flat in src
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "src"))
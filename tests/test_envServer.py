@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pytest
+
+from envServer import EnvClient, EnvServer
+from subprocEnvironment import SubprocVecEnv
+
+NUM_ENVS = 5
+NUM_STEPS = 20
+DOMAINS = [("simple_cover", {"gridSize": 6, "nAgents": 4}),
+           ("simple_reference", {"gridSize": 6, "nAgents": 2, "horizon": 5}),
+           ("simple_speaker_listener", {"gridSize": 6, "landMarks": 3})]
+
+
+@pytest.fixture(params=["tcp", "unix"])
+def address(request):
+    if request.param == "tcp":
+        yield ("127.0.0.1", 0)
+    else:
+        #  Unix socket paths are short, tmp_path may be too long
+        directory = tempfile.mkdtemp()
+        yield os.path.join(directory, "env.sock")
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+@pytest.mark.parametrize("domain, envKwargs", DOMAINS,
+                         ids=[domain for domain, _ in DOMAINS])
+def testPipelinedStepsMatchSubprocVecEnv(address, domain, envKwargs):
+    server = EnvServer(domain, address, numEnvs=NUM_ENVS, seed=3,
+                       **envKwargs)
+    thread = threading.Thread(target=server.serve, args=(1,), daemon=True)
+    thread.start()
+    client = EnvClient(server.address)
+    local = SubprocVecEnv(domain, numEnvs=NUM_ENVS, numWorkers=2, seed=3,
+                          **envKwargs)
+
+    try:
+        assert np.array_equal(client.getAllStates(), local.getAllStates())
+
+        rng = np.random.default_rng(0)
+        actions = rng.integers(0, 5, (NUM_STEPS, NUM_ENVS) +
+                               client.actionShape)
+
+        #  Two steps in flight at all times
+        client.step_async(actions[0])
+        client.step_async(actions[1])
+        results = []
+        for t in range(2, NUM_STEPS):
+            results.append(client.step_wait())
+            client.step_async(actions[t])
+        results += [client.step_wait(), client.step_wait()]
+
+        for t in range(NUM_STEPS):
+            expected = local.step(actions[t])
+            for actual, wanted in zip(results[t], expected):
+                assert np.array_equal(actual, wanted), "step %d" % t
+
+        assert np.array_equal(client.reset(), local.reset())
+    finally:
+        client.close()
+        local.close()
+        thread.join(5)
+        server.close()
+
+    assert not thread.is_alive()
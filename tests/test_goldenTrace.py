@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+import glob
+import os
+import pytest
+
+from goldenTrace import GoldenTrace, compare, standardCandidates
+from registry import singleDomains
+
+#  Recorded with goldenTrace.py record ... --world 1, so that the batched
+#  and multiprocess envs are replayed too
+FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(__file__),
+                                         "fixtures", "*.npz")))
+
+
+def testEveryDomainHasATrace():
+    domains = {GoldenTrace.load(path).domain for path in FIXTURES}
+    assert domains == set(singleDomains())
+
+
+@pytest.mark.parametrize("path", FIXTURES, ids=os.path.basename)
+def testGoldenTrace(path):
+    trace = GoldenTrace.load(path)
+    rows = compare(trace, standardCandidates(trace))
+
+    failures = ["%s: %s" % (name, divergence)
+                for name, divergence, seconds, speedup in rows
+                if divergence is not None]
+    assert not failures, "\n".join(failures)
+    assert len(rows) >= 3